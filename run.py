@@ -5,17 +5,29 @@ Utility script to run the FastAPI application.
 
 import uvicorn
 import os
+import sys
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
 if __name__ == "__main__":
-    # Check if OpenAI API key is set
-    if not os.getenv("OPENAI_API_KEY"):
-        print("Warning: OPENAI_API_KEY not found in environment variables.")
-        print("Please set it in your .env file or export it.")
-        print("You may encounter errors when making queries.")
+    # src.main refuses to start without a usable key; fail here too, before spawning workers
+    if os.getenv("OPENAI_API_KEY", "") in ("", "your_openai_api_key_here"):
+        sys.exit("OPENAI_API_KEY is missing or set to the .env.example placeholder.")
     
     # Run the FastAPI application
-    uvicorn.run("src.main:app", host="0.0.0.0", port=8001, reload=True) 
\ No newline at end of file
+    if (os.getenv("ENV") or "dev") == "dev":
+        # Single process that restarts on code changes
+        uvicorn.run("src.main:app", host="0.0.0.0", port=8001, reload=True)
+    else:
+        # Sessions live in the shared SQLite store, so any worker can serve any request
+        uvicorn.run(
+            "src.main:app",
+            host="0.0.0.0",
+            port=8001,
+            loop="uvloop",
+            http="httptools",
+            workers=int(os.getenv("WEB_CONCURRENCY") or os.cpu_count() or 2),
+            reload=False
+        ) 
\ No newline at end of file
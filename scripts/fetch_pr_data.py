@@ -5,14 +5,15 @@ Script to fetch pull request data from GitHub and prepare it for indexing.
 
 import os
 import sys
+import asyncio
 from pathlib import Path
 from dotenv import load_dotenv
-import requests
+import httpx
 from datetime import datetime
-import json
-from typing import Dict, List, Optional
-import tempfile
-import subprocess
+import orjson
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 
 # Load environment variables
 load_dotenv()
@@ -20,6 +21,22 @@ load_dotenv()
 # Constants
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
 PR_DATA_DIR = os.path.join(DATA_DIR, "pr_data")
+# Kept outside DATA_DIR so the cache is never picked up by index_data.py
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".pr_cache")
+
+# Closed/merged PRs are immutable and cached forever; open PRs only briefly
+OPEN_PR_CACHE_TTL = 10 * 60  # seconds
+
+# Zero-width match at the start of every "@@ ... @@" hunk header line
+HUNK_HEADER_PATTERN = re.compile(r"^(?=@@)", re.MULTILINE)
+
+# Maximum number of PRs processed concurrently (keeps us under GitHub's secondary rate limits)
+MAX_CONCURRENT_PRS = 10
+
+# Transient responses retried with exponential backoff (429 honours Retry-After when present)
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+MAX_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 1.0
 
 class PRDataFetcher:
     def __init__(self, token: str, repo_owner: str, repo_name: str):
@@ -31,107 +48,165 @@ class PRDataFetcher:
             "Authorization": f"token {token}",
             "Accept": "application/vnd.github.v3+json"
         }
+        # One client shared by every call so connections (and TLS sessions) are reused
+        transport = httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=3,  # Retries failed connection attempts; status-based retries happen in _get
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=20)
+        )
+        self.client = httpx.AsyncClient(headers=self.headers, transport=transport)
+    
+    async def close(self):
+        """Close the underlying HTTP client."""
+        await self.client.aclose()
+    
+    async def _get(self, url: str, **kwargs) -> httpx.Response:
+        """GET a URL, retrying rate-limited and transient gateway responses with backoff."""
+        for attempt in range(MAX_RETRIES + 1):
+            response = await self.client.get(url, **kwargs)
+            if response.status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES:
+                return response
+            delay = RETRY_BACKOFF_SECONDS * 2 ** attempt
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            print(f"  GitHub returned {response.status_code} for {url}, retrying in {delay:.0f}s")
+            await asyncio.sleep(delay)
+        return response
     
-    def fetch_pr_list(self, state: str = "all") -> List[Dict]:
+    async def _get_json(self, url: str, params: Optional[Dict] = None):
+        """GET a GitHub API endpoint and return the decoded JSON body."""
+        response = await self._get(url, params=params)
+        response.raise_for_status()
+        return orjson.loads(response.content)
+    
+    async def _paginate(self, url: str, params: Optional[Dict] = None) -> List[Dict]:
+        """GET every page of a paginated GitHub endpoint and return all items.
+        
+        When the first response advertises the last page, the remaining pages are
+        fetched concurrently; otherwise the `next` links are followed in order."""
+        params = {"per_page": 100, **(params or {})}
+        response = await self._get(url, params=params)
+        response.raise_for_status()
+        items = orjson.loads(response.content)
+        
+        last_link = response.links.get("last")
+        if last_link:
+            last_page = int(httpx.URL(last_link["url"]).params.get("page", 1))
+            pages = await asyncio.gather(*(
+                self._get_json(url, {**params, "page": page}) for page in range(2, last_page + 1)
+            ))
+            for page in pages:
+                items.extend(page)
+            return items
+        
+        next_link = response.links.get("next")
+        while next_link:
+            response = await self._get(next_link["url"])
+            response.raise_for_status()
+            items.extend(orjson.loads(response.content))
+            next_link = response.links.get("next")
+        
+        return items
+    
+    async def fetch_pr_list(self, state: str = "all") -> List[Dict]:
         """Fetch list of pull requests."""
         url = f"{self.base_url}/pulls"
-        params = {"state": state, "per_page": 100}
-        response = requests.get(url, headers=self.headers, params=params)
-        response.raise_for_status()
-        return response.json()
+        return await self._paginate(url, {"state": state})
     
-    def fetch_pr_details(self, pr_number: int) -> Dict:
+    async def fetch_pr_details(self, pr_number: int) -> Dict:
         """Fetch detailed information about a specific PR."""
         url = f"{self.base_url}/pulls/{pr_number}"
-        response = requests.get(url, headers=self.headers)
-        response.raise_for_status()
-        return response.json()
+        return await self._get_json(url)
     
-    def fetch_pr_files(self, pr_number: int) -> List[Dict]:
+    async def fetch_pr_files(self, pr_number: int) -> List[Dict]:
         """Fetch list of files changed in a PR."""
         url = f"{self.base_url}/pulls/{pr_number}/files"
-        response = requests.get(url, headers=self.headers)
-        response.raise_for_status()
-        return response.json()
+        return await self._paginate(url)
     
-    def fetch_pr_comments(self, pr_number: int) -> List[Dict]:
+    async def fetch_pr_comments(self, pr_number: int) -> List[Dict]:
         """Fetch comments on a PR."""
         url = f"{self.base_url}/issues/{pr_number}/comments"
-        response = requests.get(url, headers=self.headers)
-        response.raise_for_status()
-        return response.json()
+        return await self._paginate(url)
     
-    def fetch_pr_reviews(self, pr_number: int) -> List[Dict]:
+    async def fetch_pr_reviews(self, pr_number: int) -> List[Dict]:
         """Fetch reviews on a PR."""
         url = f"{self.base_url}/pulls/{pr_number}/reviews"
-        response = requests.get(url, headers=self.headers)
-        response.raise_for_status()
-        return response.json()
-    
-    def get_file_diff(self, pr_number: int) -> Dict[str, str]:
-        """Get all file diffs for a PR at once."""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Clone the repository
-            repo_url = f"https://github.com/{self.repo_owner}/{self.repo_name}.git"
-            subprocess.run(["git", "clone", repo_url, temp_dir], check=True)
-            
-            # Fetch the PR branch
-            os.chdir(temp_dir)
-            subprocess.run(["git", "fetch", "origin", f"pull/{pr_number}/head:pr-{pr_number}"], check=True)
-            subprocess.run(["git", "checkout", f"pr-{pr_number}"], check=True)
-            
-            # Get all changed files
-            result = subprocess.run(
-                ["git", "diff", "--name-only", "origin/main"],
-                capture_output=True,
-                text=True
-            )
-            changed_files = result.stdout.strip().split('\n')
-            
-            # Get diff for each file
-            file_diffs = {}
-            for file_path in changed_files:
-                if file_path:  # Skip empty lines
-                    result = subprocess.run(
-                        ["git", "diff", "origin/main", "--", file_path],
-                        capture_output=True,
-                        text=True
-                    )
-                    file_diffs[file_path] = result.stdout
+        return await self._paginate(url)
+    
+    async def fetch_cached(self, endpoint: str, pr_data: Dict, fetch: Callable[[int], Awaitable[Any]]) -> Any:
+        """Return a PR endpoint response from the on-disk cache, fetching it on a miss.
+        
+        Entries are keyed by PR number, endpoint and head commit SHA, so a new push
+        to the PR naturally invalidates them."""
+        pr_number = pr_data["number"]
+        head_sha = pr_data["head"]["sha"]
+        cache_file = os.path.join(CACHE_DIR, f"{pr_number}_{endpoint}_{head_sha}.json")
+        
+        if os.path.exists(cache_file):
+            is_fresh = pr_data["state"] != "open" or time.time() - os.path.getmtime(cache_file) < OPEN_PR_CACHE_TTL
+            if is_fresh:
+                with open(cache_file, "rb") as f:
+                    return orjson.loads(f.read())
+        
+        result = await fetch(pr_number)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(cache_file, "wb") as f:
+            f.write(orjson.dumps(result))
+        return result
+    
+    async def get_file_diff(self, pr_number: int) -> Dict[str, str]:
+        """Get all file diffs for a PR at once from the GitHub diff media type."""
+        url = f"{self.base_url}/pulls/{pr_number}"
+        response = await self._get(url, headers={"Accept": "application/vnd.github.v3.diff"})
+        try:
+            response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            # GitHub refuses to render diffs that are too large; fall back to the per-file patches
+            if e.response.status_code == 406:
+                print(f"  Diff for PR #{pr_number} is too large, using per-file patches")
+                return {}
+            raise
         
-            return file_diffs
+        # Split the unified diff into one entry per file on the "diff --git" headers
+        file_diffs = {}
+        for file_diff in re.split(r"^(?=diff --git )", response.text, flags=re.MULTILINE):
+            if not file_diff.startswith("diff --git "):
+                continue
+            header = file_diff.split("\n", 1)[0]
+            # Header format: diff --git a/<old path> b/<new path>
+            file_path = header.rsplit(" b/", 1)[-1]
+            file_diffs[file_path] = file_diff
+        
+        return file_diffs
 
-def process_pr_data(pr_data: Dict, fetcher: PRDataFetcher) -> Dict:
+async def process_pr_data(pr_data: Dict, fetcher: PRDataFetcher) -> Dict:
     """Process PR data into a format suitable for indexing."""
     pr_number = pr_data["number"]
     
-    # Fetch additional PR details
-    files = fetcher.fetch_pr_files(pr_number)
-    comments = fetcher.fetch_pr_comments(pr_number)
-    reviews = fetcher.fetch_pr_reviews(pr_number)
-    
-    # Get all file diffs at once
-    print("  Fetching all file diffs...")
-    file_diffs = fetcher.get_file_diff(pr_number)
+    # Fetch additional PR details and all file diffs concurrently
+    print("  Fetching PR files, comments, reviews and diffs...")
+    files, comments, reviews, file_diffs = await asyncio.gather(
+        fetcher.fetch_cached("files", pr_data, fetcher.fetch_pr_files),
+        fetcher.fetch_cached("comments", pr_data, fetcher.fetch_pr_comments),
+        fetcher.fetch_cached("reviews", pr_data, fetcher.fetch_pr_reviews),
+        fetcher.fetch_cached("diff", pr_data, fetcher.get_file_diff)
+    )
     print(f"  Found {len(file_diffs)} changed files")
     
-    # Process files with diffs
+    # Process files with diffs, accumulating the PR summary as we go
     processed_files = []
+    total_additions = 0
+    total_deletions = 0
+    file_types = set()
+    main_changes = []
     for file in files:
         try:
-            diff = file_diffs.get(file["filename"], "")
+            # Fall back to the per-file patch GitHub includes in the files listing
+            diff = file_diffs.get(file["filename"]) or file.get("patch", "")
             
-            # Split diff into chunks for better LLM processing
-            diff_chunks = []
-            current_chunk = []
-            for line in diff.split('\n'):
-                if line.startswith('@@') and current_chunk:
-                    # Start new chunk when we hit a new hunk
-                    diff_chunks.append('\n'.join(current_chunk))
-                    current_chunk = []
-                current_chunk.append(line)
-            if current_chunk:
-                diff_chunks.append('\n'.join(current_chunk))
+            # Split diff into chunks for better LLM processing, starting a new chunk at each hunk
+            diff_chunks = [hunk for hunk in HUNK_HEADER_PATTERN.split(diff) if hunk.strip()]
             
             # Create a summary of changes
             summary = {
@@ -148,16 +223,22 @@ def process_pr_data(pr_data: Dict, fetcher: PRDataFetcher) -> Dict:
                 "diff_chunks": diff_chunks,
                 "full_diff": diff  # Keep full diff for reference
             })
+            
+            total_additions += summary["additions"]
+            total_deletions += summary["deletions"]
+            file_types.add(summary["file_type"])
+            if summary["total_changes"] > 10:
+                main_changes.append(file["filename"])
         except Exception as e:
             print(f"Error processing file {file['filename']}: {e}")
     
     # Create a summary of the PR
     pr_summary = {
         "total_files_changed": len(processed_files),
-        "total_additions": sum(f["summary"]["additions"] for f in processed_files),
-        "total_deletions": sum(f["summary"]["deletions"] for f in processed_files),
-        "file_types": list(set(f["summary"]["file_type"] for f in processed_files)),
-        "main_changes": [f["filename"] for f in processed_files if f["summary"]["total_changes"] > 10]
+        "total_additions": total_additions,
+        "total_deletions": total_deletions,
+        "file_types": list(file_types),
+        "main_changes": main_changes
     }
     
     return {
@@ -183,7 +264,32 @@ def process_pr_data(pr_data: Dict, fetcher: PRDataFetcher) -> Dict:
         } for review in reviews]
     }
 
-def main():
+async def handle_pr(pr_number: int, fetcher: PRDataFetcher, semaphore: asyncio.Semaphore):
+    """Fetch, process and save a single PR."""
+    async with semaphore:
+        print(f"\nProcessing PR #{pr_number}")
+        
+        try:
+            print(f"  Fetching PR #{pr_number} details...")
+            # Fetch PR details directly
+            pr_data = await fetcher.fetch_pr_details(pr_number)
+            print(f"  Found PR: {pr_data['title']}")
+            
+            # Process PR data
+            processed_data = await process_pr_data(pr_data, fetcher)
+            
+            # Save to file
+            output_file = os.path.join(PR_DATA_DIR, f"pr_{pr_number}.json")
+            print(f"  Saving PR data to {output_file}")
+            with open(output_file, "wb") as f:
+                f.write(orjson.dumps(processed_data, option=orjson.OPT_INDENT_2))
+            
+            print(f"  Successfully saved PR #{pr_number} data")
+        except Exception as e:
+            print(f"Error processing PR #{pr_number}: {e}")
+            print(f"Error details: {str(e)}")
+
+async def main():
     """Main function to fetch and process PR data."""
     print("Starting PR data fetch...")
     
@@ -215,29 +321,10 @@ def main():
         target_prs = [1440, 1441]
         print(f"\nFetching specific pull requests: {target_prs}")
         
-        # Process each target PR
-        for pr_number in target_prs:
-            print(f"\nProcessing PR #{pr_number}")
-            
-            try:
-                print("  Fetching PR details...")
-                # Fetch PR details directly
-                pr_data = fetcher.fetch_pr_details(pr_number)
-                print(f"  Found PR: {pr_data['title']}")
-                
-                # Process PR data
-                processed_data = process_pr_data(pr_data, fetcher)
-                
-                # Save to file
-                output_file = os.path.join(PR_DATA_DIR, f"pr_{pr_number}.json")
-                print(f"  Saving PR data to {output_file}")
-                with open(output_file, "w") as f:
-                    json.dump(processed_data, f, indent=2)
-                
-                print(f"  Successfully saved PR #{pr_number} data")
-            except Exception as e:
-                print(f"Error processing PR #{pr_number}: {e}")
-                print(f"Error details: {str(e)}")
+        # Process all target PRs concurrently, bounded by the semaphore
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_PRS)
+        tasks = [asyncio.create_task(handle_pr(pr_number, fetcher, semaphore)) for pr_number in target_prs]
+        await asyncio.gather(*tasks)
         
         print("\nPR data fetching completed successfully!")
         print(f"Data saved in: {PR_DATA_DIR}")
@@ -245,6 +332,8 @@ def main():
         print(f"Error during PR data fetching: {e}")
         print(f"Error details: {str(e)}")
         sys.exit(1)
+    finally:
+        await fetcher.close()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    asyncio.run(main())
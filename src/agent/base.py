@@ -1,32 +1,34 @@
-from typing import List, Dict, Any, Literal
-from pydantic import BaseModel
+from typing import List, Dict, Any, AsyncIterator, Literal, Optional, Set, Tuple, Union
+from dataclasses import dataclass
+from llama_index.core.llms import ChatMessage, MessageRole
 from llama_index.llms.openai import OpenAI
 from src.schemas.chat import ChatResponse
-import json
-import re
+from src.agent.cache import SemanticResponseCache
+from src.agent.llm import shared_llm
+from src.core.rag_utils import source_key
+import asyncio
+import logging
+import orjson
 
-class Tool(BaseModel):
-    name: str
-    description: str
-    parameters: Dict[str, Any]
-    
-    async def execute(self, **kwargs) -> Dict[str, Any]:
-        """Execute the tool with the given parameters.
-        This method should be implemented by subclasses."""
-        raise NotImplementedError("Tool execution not implemented")
+logger = logging.getLogger(__name__)
 
-class BaseAgent:
-    def __init__(self, llm: OpenAI):
-        self.llm = llm
-        self.tools: List[Tool] = []
-        self.system_prompts = {
-            "co_reviewer": self._get_co_reviewer_prompt(),
-            "interactive_assistant": self._get_interactive_assistant_prompt()
-        }
-        
-    def _get_co_reviewer_prompt(self) -> str:
-        """Get the system prompt for co-reviewer mode."""
-        return """You are an intelligent Code Review Assistant Agent in CO-REVIEWER mode. Your task is to help with code reviews by:
+# Answer when neither the tools nor the LLM produced one; a tool-calling reply usually has no text of its own
+FALLBACK_ANSWER = "Sorry, there was an error gathering information about this PR. Please try again."
+
+# Shared by both mode prompts: where the tool manifest goes and the tool-selection contract
+TOOLS_SECTION = """Available Tools:
+{tools_list}
+
+"""
+
+TOOL_SELECTION_FORMAT = """Always explain your reasoning and be transparent about what information you're using.
+
+Tool Usage:
+If you need information about the PR, call the appropriate tools (you may call several at once).
+If the request can be answered without tools, reply with your final answer directly.
+"""
+
+CO_REVIEWER_PROMPT = """You are an intelligent Code Review Assistant Agent in CO-REVIEWER mode. Your task is to help with code reviews by:
 1. Understanding the user's request in the context of a specific Pull Request
 2. Selecting appropriate tools to gather information about the PR
 3. Synthesizing responses that provide insightful code review feedback
@@ -37,36 +39,15 @@ In CO-REVIEWER mode:
 - Your responses should be structured and thorough
 - First messages should provide a comprehensive initial review
 
-Available Tools:
-{tools_list}
-
-When responding:
+""" + TOOLS_SECTION + """When responding:
 1. First analyze the PR and the user's request
 2. Determine which tools would be helpful
 3. Use the tools to gather specific information about the code
 4. Synthesize a helpful, detailed response with concrete suggestions
 
-Always explain your reasoning and be transparent about what information you're using.
-
-Tool Selection Format:
-If you need to use tools, respond in this JSON format:
-{{
-  "reasoning": "Your reasoning for tool selection",
-  "tools": [
-    {{
-      "name": "tool_name",
-      "parameters": {{
-        "param1": "value1",
-        "param2": "value2"
-      }}
-    }}
-  ]
-}}
-"""
+""" + TOOL_SELECTION_FORMAT
 
-    def _get_interactive_assistant_prompt(self) -> str:
-        """Get the system prompt for interactive assistant mode."""
-        return """You are an intelligent Code Review Assistant Agent in INTERACTIVE ASSISTANT mode. Your task is to help with code reviews by:
+INTERACTIVE_ASSISTANT_PROMPT = """You are an intelligent Code Review Assistant Agent in INTERACTIVE ASSISTANT mode. Your task is to help with code reviews by:
 1. Answering the user's specific questions about code
 2. Selecting appropriate tools to gather relevant information
 3. Synthesizing concise, focused responses that directly address queries
@@ -77,67 +58,129 @@ In INTERACTIVE ASSISTANT mode:
 - Your responses should be concise and focused on the exact question asked
 - You only provide information that was explicitly requested
 
-Available Tools:
-{tools_list}
-
-When responding:
+""" + TOOLS_SECTION + """When responding:
 1. First analyze the specific query
 2. Determine which tools would be helpful to answer it
 3. Use the tools to gather precisely the information needed
 4. Synthesize a direct, focused response that answers only what was asked
 
-Always explain your reasoning and be transparent about what information you're using.
+""" + TOOL_SELECTION_FORMAT
 
-Tool Selection Format:
-If you need to use tools, respond in this JSON format:
-{{
-  "reasoning": "Your reasoning for tool selection",
-  "tools": [
-    {{
-      "name": "tool_name",
-      "parameters": {{
-        "param1": "value1",
-        "param2": "value2"
-      }}
-    }}
-  ]
-}}
-"""
+@dataclass(slots=True)
+class Tool:
+    name: str
+    description: str
+    parameters: Dict[str, Any]
+    
+    async def execute(self, **kwargs) -> Dict[str, Any]:
+        """Execute the tool with the given parameters.
+        This method should be implemented by subclasses."""
+        raise NotImplementedError("Tool execution not implemented")
+    
+    def to_manifest_entry(self) -> str:
+        """Describe the tool for the system prompt's tools list."""
+        buf = ["- ", self.name, ": ", self.description, "\n  Parameters:"]
+        for param_name, param_details in sorted(self.parameters.items()):
+            buf += ["\n  - ", param_name, " (", param_details.get("type", "any"), "): ", param_details.get("description", "")]
+        return "".join(buf)
+    
+    def to_openai_schema(self) -> Dict[str, Any]:
+        """Describe the tool in OpenAI's function-calling format."""
+        properties = {}
+        for param_name, param_details in sorted(self.parameters.items()):
+            prop = {"type": param_details.get("type", "string"), "description": param_details.get("description", "")}
+            if prop["type"] == "array":
+                prop["items"] = param_details.get("items", {})
+            properties[param_name] = prop
+        return {
+            "type": "function",
+            "function": {
+                "name": self.name,
+                "description": self.description,
+                "parameters": {"type": "object", "properties": properties, "required": sorted(self.parameters)}
+            }
+        }
 
+class BaseAgent:
+    def __init__(self, llm: Optional[OpenAI] = None, response_cache: Optional[SemanticResponseCache] = None):
+        self.llm = llm or shared_llm
+        self.response_cache = response_cache
+        self.tools: List[Tool] = []
+        self._tool_by_name: Dict[str, Tool] = {}
+        # Tools list entry per tool name, formatted once at registration
+        self._tool_manifest_entries: Dict[str, str] = {}
+        # Function-calling schemas, sorted by name so the request prefix stays stable
+        self._tool_schemas: List[Dict[str, Any]] = []
+        # Running collection prefetches, referenced so they aren't garbage collected mid-flight
+        self._prefetch_tasks: Set[asyncio.Task] = set()
+        # Running response cache stores, likewise referenced until they finish
+        self._cache_tasks: Set[asyncio.Task] = set()
+        self.system_prompts = {
+            "co_reviewer": CO_REVIEWER_PROMPT,
+            "interactive_assistant": INTERACTIVE_ASSISTANT_PROMPT
+        }
+        # Rendered tools manifest and system prompt per mode; tools are only registered at startup
+        self._tools_manifest_cache: Optional[str] = None
+        self._system_prompt_cache: Dict[str, str] = {}
+        
     def register_tool(self, tool: Tool):
         """Register a new tool with the agent."""
         self.tools.append(tool)
+        self._tool_by_name[tool.name] = tool
+        self._tool_manifest_entries[tool.name] = tool.to_manifest_entry()
+        self._tool_schemas = [t.to_openai_schema() for t in sorted(self.tools, key=lambda t: t.name)]
+        self._tools_manifest_cache = None
+        self._system_prompt_cache.clear()
         
-    def _format_tools_prompt(self, mode: str) -> str:
-        """Format the tools list for the system prompt."""
-        tools_formatted = []
+    def _tools_manifest(self) -> str:
+        """Format the tools list for the system prompt. Shared by every mode."""
+        if self._tools_manifest_cache is not None:
+            return self._tools_manifest_cache
         
-        for tool in self.tools:
-            # Format parameters
-            params_formatted = []
-            for param_name, param_details in tool.parameters.items():
-                param_type = param_details.get("type", "any")
-                param_desc = param_details.get("description", "")
-                params_formatted.append(f"  - {param_name} ({param_type}): {param_desc}")
-                
-            # Add the formatted tool
-            tools_formatted.append(
-                f"- {tool.name}: {tool.description}\n"
-                f"  Parameters:\n"
-                f"{chr(10).join(params_formatted)}"
-            )
-            
-        system_prompt = self.system_prompts.get(mode, self.system_prompts["co_reviewer"])
-        return system_prompt.format(tools_list="\n\n".join(tools_formatted))
+        # Sorted so the rendered prompt is byte-identical across requests (keeps it prefix-cacheable)
+        tools_formatted = [self._tool_manifest_entries[name] for name in sorted(self._tool_manifest_entries)]
+        self._tools_manifest_cache = "\n\n".join(tools_formatted)
+        return self._tools_manifest_cache
         
-    async def process_request(self, request: str, session_data: Dict[str, Any]) -> ChatResponse:
-        """Process a user request using the agent."""
-        # Get mode from session data, default to co_reviewer
+    def _system_prompt(self, mode: str) -> str:
+        """Return the mode's system prompt with the tools manifest filled in."""
+        if mode not in self._system_prompt_cache:
+            system_prompt = self.system_prompts.get(mode, self.system_prompts["co_reviewer"])
+            self._system_prompt_cache[mode] = system_prompt.format(tools_list=self._tools_manifest())
+        return self._system_prompt_cache[mode]
+        
+    def _prefetch_collections(self, session_data: Dict[str, Any]):
+        """Start loading the session's unloaded collections from disk in the background. Run while the LLM picks
+        tools, so retrieval rarely waits on a load. Collection handles are shared per PR, so this is paid once per PR."""
+        session = session_data.get("session")
+        if session is None:
+            return
+        pending = [handle for handle in session.query_engines.values() if not handle.loaded]
+        if not pending:
+            return
+        
+        async def prefetch():
+            results = await asyncio.gather(*(handle.aload() for handle in pending), return_exceptions=True)
+            for handle, result in zip(pending, results):
+                if isinstance(result, Exception):
+                    # The retrieval that needs the collection retries the load and reports the error
+                    logger.debug("Prefetching collection '%s' failed: %s", handle.collection_name, result)
+        
+        task = asyncio.create_task(prefetch())
+        self._prefetch_tasks.add(task)
+        task.add_done_callback(self._prefetch_tasks.discard)
+    
+    async def _run_tools(self, request: str, session_data: Dict[str, Any]) -> Tuple[str, List[str], List[Dict]]:
+        """Ask the LLM which tools to use and run them. Returns (analysis, tools_used, tools_results).
+        When no tools are called, analysis is the LLM's final answer."""
         mode = session_data.get("mode", "co_reviewer")
         is_initial_request = session_data.get("is_initial_request", False)
         
-        # Format the prompt with tools and request
-        prompt = f"""User Request: {request}
+        # The static system prompt and tool manifest go first and the per-request details last,
+        # so the leading tokens are identical across calls and hit OpenAI's automatic prompt cache
+        messages = [
+            ChatMessage(role=MessageRole.SYSTEM, content=self._system_prompt(mode)),
+            ChatMessage(role=MessageRole.USER, content=f"""User Request: {request}
 
 Current Session Data:
 - PR ID: {session_data.get('pr_id', 'Unknown')}
@@ -146,126 +189,209 @@ Current Session Data:
 - Mode: {mode}
 - Is Initial Request: {is_initial_request}
 
-Available Tools:
-{self._format_tools_prompt(mode)}
-
-Please analyze the request and determine which tools to use. Explain your reasoning.
-Respond in the JSON format specified if you need to use tools."""
+Call the tools you need, or answer directly if none are needed.""")
+        ]
 
-        # Get initial analysis from LLM
-        analysis = self.llm.complete(prompt)
+        self._prefetch_collections(session_data)
+        # One function-calling round trip returns either tool calls or the final answer
+        message = (await self.llm.achat(messages, tools=self._tool_schemas)).message
+        analysis = message.content or ""
         tools_used = []
+        tools_results = []
         
         try:
-            # Parse the analysis to see if it contains tool selections
-            tool_selections = self._extract_json(str(analysis))
+            selected_tool_calls = message.additional_kwargs.get("tool_calls") or []
             
-            if tool_selections and "tools" in tool_selections:
-                # Execute the selected tools
-                tools_results = []
-                for tool_selection in tool_selections["tools"]:
-                    tool_name = tool_selection.get("name")
-                    tool_params = tool_selection.get("parameters", {})
+            if selected_tool_calls:
+                # Execute the selected tools concurrently
+                tool_calls = []
+                for selected_tool_call in selected_tool_calls:
+                    tool_name = selected_tool_call.function.name
+                    tool_params = orjson.loads(selected_tool_call.function.arguments or "{}")
                     
-                    # Find the tool
-                    tool = next((t for t in self.tools if t.name == tool_name), None)
+                    # Find the tool, skipping names the LLM made up
+                    tool = self._tool_by_name.get(tool_name)
                     if tool:
                         tools_used.append(tool_name)
-                        # Execute the tool
-                        result = await tool.execute(**tool_params, session_data=session_data)
-                        tools_results.append({
-                            "tool": tool_name,
-                            "result": result
-                        })
+                        tool_calls.append(tool.execute(**tool_params, session_data=session_data))
                 
-                # Synthesize final response
-                if tools_results:
-                    final_response = await self._synthesize_response(request, tools_results, session_data)
-                    return final_response
+                results = await asyncio.gather(*tool_calls, return_exceptions=True)
+                for tool_name, result in zip(tools_used, results):
+                    if isinstance(result, Exception):
+                        logger.error("Error executing tool '%s': %s", tool_name, result)
+                        continue
+                    tools_results.append({
+                        "tool": tool_name,
+                        "result": result
+                    })
         except Exception as e:
-            print(f"Error executing tools: {e}")
+            logger.error("Error executing tools: %s", e)
             # Continue with default response if tool execution fails
         
-        # Default response if no tools were used or execution failed
+        return analysis, tools_used, tools_results
+    
+    def _default_response(self, analysis: str, tools_used: List[str], session_data: Dict[str, Any]) -> ChatResponse:
+        """Response used when no tools were used or tool execution failed: the LLM's analysis itself,
+        or FALLBACK_ANSWER when it is empty (as it is when the LLM called tools)."""
         return ChatResponse(
             session_id=session_data.get("session_id", "new_session"),
-            answer=str(analysis),
+            answer=analysis or FALLBACK_ANSWER,
             sources=[],
             collections_used=[],
-            mode=mode,
+            mode=session_data.get("mode", "co_reviewer"),
             pr_id=session_data.get("pr_id", "unknown"),
             tools_used=tools_used,
             metadata={}
         )
     
-    def _extract_json(self, text: str) -> Dict[str, Any]:
-        """Extract JSON from the text."""
+    @staticmethod
+    def _is_first_turn(session_data: Dict[str, Any]) -> bool:
+        """Whether the request opens its session. Only these answers are cached: a follow-up depends on
+        a conversation that practically never repeats, so its entry would never be hit."""
+        session = session_data.get("session")
+        return session is None or not (session.rendered_history or session.history_summary)
+    
+    async def _get_cached_response(self, request: str, session_data: Dict[str, Any]) -> Optional[ChatResponse]:
+        """Return a cached response for a repeated (or near-identical) opening request on the same PR, if any."""
+        if not self.response_cache or not self._is_first_turn(session_data):
+            return None
         try:
-            # Try to parse the whole response as JSON first
-            try:
-                return json.loads(text)
-            except:
-                pass
-            
-            # Find JSON blocks, checking for code blocks
-            json_blocks = []
-            
-            # Look for JSON blocks in code fence format: ```json ... ```
-            code_pattern = r"```(?:json)?\s*([\s\S]*?)\s*```"
-            code_matches = re.findall(code_pattern, text)
-            
-            for match in code_matches:
-                try:
-                    json_obj = json.loads(match)
-                    return json_obj
-                except:
-                    pass
-            
-            # Final fallback: basic JSON extraction between { and }
-            json_start = text.find("{")
-            json_end = text.rfind("}")
-            
-            if json_start >= 0 and json_end > json_start:
-                try:
-                    json_text = text[json_start:json_end+1]
-                    return json.loads(json_text)
-                except:
-                    # Try cleaning up the text by removing line breaks etc
-                    json_text = re.sub(r'[\n\r\t]', '', json_text)
-                    try:
-                        return json.loads(json_text)
-                    except:
-                        pass
-                    
+            cached_response = await self.response_cache.get(
+                session_data.get("pr_id", "unknown"),
+                session_data.get("mode", "co_reviewer"),
+                session_data.get("is_initial_request", False),
+                request
+            )
         except Exception as e:
-            print(f"Error extracting JSON: {e}")
+            # The cache is an optimization (its lookup may call the embeddings API); answer without it
+            logger.error("Error reading the response cache: %s", e)
+            return None
+        if cached_response:
+            cached_response.session_id = session_data.get("session_id", "new_session")
+        return cached_response
+    
+    def _cache_response(self, request: str, session_data: Dict[str, Any], response: ChatResponse):
+        """Store a response to a session's opening request in the response cache, if one is configured.
+        The store (an embeddings call, plus a SQLite write for initial reviews) runs in the background,
+        so the caller hands the answer back without waiting on it."""
+        if not self.response_cache or not self._is_first_turn(session_data):
+            return
+        
+        async def store(pr_id: str, mode: str, is_initial_request: bool, response: ChatResponse):
+            try:
+                await self.response_cache.set(pr_id, mode, is_initial_request, request, response)
+            except Exception as e:
+                # The answer has already been returned; only the cache entry is lost
+                logger.error("Error writing the response cache: %s", e)
         
-        return {}
+        # Arguments are read now: the session's history is updated once the answer is returned,
+        # and the copy keeps later changes to the caller's response out of the cache
+        task = asyncio.create_task(store(
+            session_data.get("pr_id", "unknown"),
+            session_data.get("mode", "co_reviewer"),
+            session_data.get("is_initial_request", False),
+            response.model_copy(deep=True)
+        ))
+        self._cache_tasks.add(task)
+        task.add_done_callback(self._cache_tasks.discard)
     
-    async def _synthesize_response(self, request: str, tools_results: List[Dict], session_data: Dict) -> ChatResponse:
-        """Synthesize a final response from the tools results."""
-        try:
-            # Extract tools used and their results
-            tools_used = [result["tool"] for result in tools_results]
-            sources = []
-            collections_used = []
-            responses = []
-            
-            for result in tools_results:
-                if "sources" in result:
-                    sources.extend(result["sources"])
-                if "collections_used" in result:
-                    collections_used.extend(result["collections_used"])
-                if "result" in result and "responses" in result["result"]:
-                    responses.extend(result["result"]["responses"])
-            
-            # Generate a synthesized answer using the LLM
-            mode = session_data.get("mode", "co_reviewer")
-            is_initial_request = session_data.get("is_initial_request", False)
-            
-            # Format the prompt based on mode and request type
-            if mode == "co_reviewer" and is_initial_request:
-                prompt = f"""Based on the following information about the PR, provide a comprehensive initial code review summary:
+    async def process_request(self, request: str, session_data: Dict[str, Any]) -> ChatResponse:
+        """Process a user request using the agent."""
+        # Repeated requests on the same PR skip both LLM calls and all tool I/O
+        cached_response = await self._get_cached_response(request, session_data)
+        if cached_response:
+            return cached_response
+        
+        analysis, tools_used, tools_results = await self._run_tools(request, session_data)
+        
+        # The caller only wants what the tools gathered, so skip the synthesis LLM call (and don't cache the result)
+        if tools_results and not session_data.get("synthesize", True):
+            _, response = self._prepare_synthesis(request, tools_results, session_data)
+            return response
+        
+        # Synthesize final response
+        if tools_results:
+            try:
+                final_response = await self._synthesize_response(request, tools_results, session_data)
+                self._cache_response(request, session_data, final_response)
+                return final_response
+            except Exception as e:
+                logger.error("Error synthesizing response: %s", e)
+                # Continue with default response if synthesis fails
+        
+        # Default response if no tools were used or execution failed
+        response = self._default_response(analysis, tools_used, session_data)
+        # Only cache direct answers, not fallbacks from failed tool execution
+        if not tools_used and analysis:
+            self._cache_response(request, session_data, response)
+        return response
+    
+    async def stream_request(self, request: str, session_data: Dict[str, Any]) -> AsyncIterator[Union[str, Dict, ChatResponse]]:
+        """Process a user request like process_request, but stream the answer.
+        Yields a sources dict when the answer is synthesized from tool results, the answer's text deltas
+        as they are generated, then the complete ChatResponse."""
+        cached_response = await self._get_cached_response(request, session_data)
+        if cached_response:
+            yield cached_response.answer
+            yield cached_response
+            return
+        
+        analysis, tools_used, tools_results = await self._run_tools(request, session_data)
+        
+        if tools_results:
+            streamed_text = False
+            try:
+                async for item in self._stream_synthesized_response(request, tools_results, session_data):
+                    if isinstance(item, ChatResponse):
+                        self._cache_response(request, session_data, item)
+                    streamed_text = streamed_text or isinstance(item, str)
+                    yield item
+                return
+            except Exception as e:
+                # Part of an answer can't be taken back; before that, fall back like process_request
+                if streamed_text:
+                    raise
+                logger.error("Error synthesizing response: %s", e)
+        
+        response = self._default_response(analysis, tools_used, session_data)
+        if not tools_used and analysis:
+            self._cache_response(request, session_data, response)
+        yield response.answer
+        yield response
+    
+    def _prepare_synthesis(self, request: str, tools_results: List[Dict], session_data: Dict) -> Tuple[str, ChatResponse]:
+        """Build the synthesis prompt and the response it will fill in.
+        The response's answer is the gathered information until the synthesized answer replaces it."""
+        # Extract tools used and their results
+        tools_used = [result["tool"] for result in tools_results]
+        # Tools often return the same nodes (e.g. rag_search and response_synthesis), so keep the first copy of each
+        sources: Dict[Tuple[str, str], Dict] = {}
+        # Insertion-ordered set, so collections are listed in first-seen order
+        collections_used: Dict[str, None] = {}
+        responses = []
+        
+        for tool_result in tools_results:
+            result = tool_result["result"]
+            # rag_search and file_analysis return raw multi_collection_retrieve responses
+            for response in result.get("responses", []) + result.get("analysis", []):
+                responses.append(f"From {response['collection']}:\n{response['answer']}")
+                for source in response.get("sources", []):
+                    sources.setdefault(source_key(source), source)
+                collections_used[response["collection"]] = None
+            # pr_summary and response_synthesis return an already synthesized answer
+            synthesized = result.get("summary") or result
+            if "answer" in synthesized or "synthesized_answer" in synthesized:
+                responses.append(synthesized.get("answer") or synthesized.get("synthesized_answer") or "")
+                for source in synthesized.get("sources", []):
+                    sources.setdefault(source_key(source), source)
+                collections_used.update(dict.fromkeys(synthesized.get("collections_used", [])))
+        
+        mode = session_data.get("mode", "co_reviewer")
+        is_initial_request = session_data.get("is_initial_request", False)
+        
+        # Format the prompt based on mode and request type
+        if mode == "co_reviewer" and is_initial_request:
+            prompt = f"""Based on the following information about the PR, provide a comprehensive initial code review summary:
 
 {chr(10).join(responses)}
 
@@ -276,33 +402,55 @@ Structure your response as follows:
 4. Next Steps: Recommend what additional information would be helpful
 
 If you don't have enough information for a specific section, say so explicitly rather than making assumptions."""
-            else:
-                prompt = f"""User Request: {request}
+        else:
+            prompt = f"""User Request: {request}
 
 Based on the following information gathered:
 {chr(10).join(responses)}
 
 Please provide a detailed response that addresses the user's request. If certain information is missing, acknowledge that and focus on what you can determine from the available data."""
 
-            # Get the synthesized answer from the LLM
-            synthesized_answer = str(self.llm.complete(prompt))
-            
-            # Create the response
-            response = ChatResponse(
-                session_id=session_data["session_id"],
-                answer=synthesized_answer,
-                sources=sources,
-                collections_used=list(set(collections_used)),  # Remove duplicates
-                mode=mode,
-                pr_id=session_data["pr_id"],
-                tools_used=tools_used,
-                metadata={
-                    "is_initial_request": is_initial_request
-                }
-            )
+        response = ChatResponse(
+            session_id=session_data["session_id"],
+            answer=chr(10).join(responses),
+            sources=list(sources.values()),
+            collections_used=list(collections_used),
+            mode=mode,
+            pr_id=session_data["pr_id"],
+            tools_used=tools_used,
+            metadata={
+                "is_initial_request": is_initial_request
+            }
+        )
+        return prompt, response
+    
+    async def _synthesize_response(self, request: str, tools_results: List[Dict], session_data: Dict) -> ChatResponse:
+        """Synthesize a final response from the tools results."""
+        try:
+            prompt, response = self._prepare_synthesis(request, tools_results, session_data)
             
+            # Get the synthesized answer from the LLM
+            response.answer = str(await self.llm.acomplete(prompt))
             return response
             
         except Exception as e:
-            print(f"Error in _synthesize_response: {e}")
-            raise e 
\ No newline at end of file
+            logger.error("Error in _synthesize_response: %s", e)
+            raise e
+    
+    async def _stream_synthesized_response(
+        self, request: str, tools_results: List[Dict], session_data: Dict
+    ) -> AsyncIterator[Union[str, Dict, ChatResponse]]:
+        """Yield the sources, then the synthesized answer as text deltas, then the complete response."""
+        prompt, response = self._prepare_synthesis(request, tools_results, session_data)
+        
+        # Sources are known before generation starts, so clients can show them while the answer streams
+        yield {"sources": response.sources, "collections_used": response.collections_used}
+        
+        answer_parts = []
+        async for chunk in await self.llm.astream_complete(prompt):
+            if chunk.delta:
+                answer_parts.append(chunk.delta)
+                yield chunk.delta
+        
+        response.answer = "".join(answer_parts)
+        yield response
@@ -0,0 +1,207 @@
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import logging
+import re
+import time
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from src.schemas.chat import ChatResponse
+from src.core import rag_utils
+from src.core.session_store import SQLiteSessionStore
+
+logger = logging.getLogger(__name__)
+
+# Runs on every request, so compiled once at import
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+class SemanticResponseCache:
+    """In-process cache of agent responses for repeated requests on the same PR.
+
+    Exact repeats are found by hashing the normalized request. On an exact miss, near-duplicates
+    are found by cosine similarity between request embeddings within the same (PR, index signature, mode, initial)
+    scope. Callers only cache requests that open a session, whose answers don't depend on earlier turns. A PR's entries are dropped once its index signature changes (it was re-indexed) or on invalidate().
+
+    Across all scopes at most max_entries responses are kept. When full, the entry with the lowest
+    GDSF priority (clock + hits / answer length) is evicted, so small, frequently hit answers stay
+    longest and the rising clock ages out entries that were popular long ago.
+
+    With a review_store, initial co_reviewer reviews are also kept there per PR and index version, so every worker
+    and every restart serves a PR's initial review after it has been generated once."""
+
+    def __init__(
+        self,
+        embed_model: Optional[BaseEmbedding] = None,
+        ttl_seconds: float = 3600,
+        similarity_threshold: float = 0.95,
+        max_entries_per_scope: int = 256,
+        max_entries: int = 10_000,
+        review_store: Optional[SQLiteSessionStore] = None
+    ):
+        self.embed_model = embed_model
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.max_entries_per_scope = max_entries_per_scope
+        self.max_entries = max_entries
+        self.review_store = review_store
+        # key -> (expires_at, response)
+        self._entries: Dict[str, Tuple[float, ChatResponse]] = {}
+        # scope -> (keys oldest first, their normalized embeddings as matrix rows, or None without an embed model)
+        self._scope_entries: Dict[Tuple, Tuple[List[str], Optional[np.ndarray]]] = {}
+        # Embeddings computed by a missed get(), reused by the following set()
+        self._pending_embeddings: Dict[str, np.ndarray] = {}
+        # GDSF eviction state: key -> (hits, priority, scope), and the priority of the last evicted entry
+        self._usage: Dict[str, Tuple[int, float, Tuple]] = {}
+        self._clock = 0.0
+        # PR ID -> index signature its entries were cached under
+        self._index_signatures: Dict[str, Optional[float]] = {}
+
+    @staticmethod
+    def _normalize(request: str) -> str:
+        return WHITESPACE_PATTERN.sub(" ", request).strip().lower()
+
+    @staticmethod
+    def _key(scope: Tuple, normalized_request: str) -> str:
+        return hashlib.sha256("|".join([*map(str, scope), normalized_request]).encode()).hexdigest()
+
+    async def _embed(self, key: str, normalized_request: str) -> np.ndarray:
+        if key in self._pending_embeddings:
+            return self._pending_embeddings.pop(key)
+        return rag_utils.normalized_embedding(await self.embed_model.aget_query_embedding(normalized_request))
+
+    def _get_fresh(self, key: str) -> Optional[ChatResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, response = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self._usage.pop(key, None)
+            return None
+        return response
+
+    def _priority(self, hits: int, response: ChatResponse) -> float:
+        return self._clock + hits / max(len(response.answer), 1)
+
+    def _record_hit(self, key: str, response: ChatResponse):
+        hits, _, scope = self._usage[key]
+        self._usage[key] = (hits + 1, self._priority(hits + 1, response), scope)
+
+    def _evict(self):
+        """Drop the entry with the lowest priority and advance the clock to it."""
+        evicted_key = min(self._usage, key=lambda key: self._usage[key][1])
+        _, self._clock, scope = self._usage.pop(evicted_key)
+        self._entries.pop(evicted_key, None)
+        keys, embeddings = self._scope_entries.get(scope, ([], None))
+        kept = np.array([key != evicted_key for key in keys], dtype=bool)
+        if kept.any():
+            self._scope_entries[scope] = (
+                [key for key, keep in zip(keys, kept) if keep],
+                embeddings[kept] if embeddings is not None else None
+            )
+        else:
+            self._scope_entries.pop(scope, None)
+
+    def _scope(self, pr_id: str, mode: str, is_initial_request: bool) -> Tuple:
+        index_signature = rag_utils.project_index_signature(pr_id)
+        if self._index_signatures.get(pr_id, index_signature) != index_signature:
+            self.invalidate(pr_id)
+        self._index_signatures[pr_id] = index_signature
+        return (pr_id, index_signature, mode, is_initial_request)
+
+    def invalidate(self, pr_id: str):
+        """Drop every cached response for the PR. Stored initial reviews are keyed on the index signature already."""
+        for key in [key for key, (_, _, scope) in self._usage.items() if scope[0] == pr_id]:
+            self._entries.pop(key, None)
+            del self._usage[key]
+        for scope in [scope for scope in self._scope_entries if scope[0] == pr_id]:
+            del self._scope_entries[scope]
+        self._index_signatures.pop(pr_id, None)
+
+    async def _get_stored_review(self, pr_id: str) -> Optional[ChatResponse]:
+        index_signature = rag_utils.project_index_signature(pr_id)
+        if index_signature is None:
+            return None
+        try:
+            stored = await asyncio.to_thread(self.review_store.get_initial_review, pr_id, index_signature)
+        except Exception as e:
+            logger.error("Error reading the stored initial review for PR '%s': %s", pr_id, e)
+            return None
+        return ChatResponse.model_validate_json(stored) if stored else None
+
+    async def _store_review(self, pr_id: str, response: ChatResponse):
+        index_signature = rag_utils.project_index_signature(pr_id)
+        if index_signature is None:
+            return
+        try:
+            await asyncio.to_thread(self.review_store.set_initial_review, pr_id, index_signature, response.model_dump_json())
+        except Exception as e:
+            logger.error("Error storing the initial review for PR '%s': %s", pr_id, e)
+
+    async def get(self, pr_id: str, mode: str, is_initial_request: bool, request: str) -> Optional[ChatResponse]:
+        """Return a copy of a cached response for this request, or None on a miss."""
+        scope = self._scope(pr_id, mode, is_initial_request)
+        normalized_request = self._normalize(request)
+        key = self._key(scope, normalized_request)
+
+        response = self._get_fresh(key)
+        if response is None and self.embed_model is not None and self._scope_entries.get(scope):
+            embedding = await self._embed(key, normalized_request)
+            if len(self._pending_embeddings) >= self.max_entries_per_scope:
+                self._pending_embeddings.clear()
+            self._pending_embeddings[key] = embedding
+            cached_keys, cached_embeddings = self._scope_entries[scope]
+            # Rows and query are unit vectors, so one matrix-vector product gives every cosine similarity
+            similarities = cached_embeddings @ embedding
+            best = int(similarities.argmax())
+            if similarities[best] >= self.similarity_threshold:
+                key = cached_keys[best]
+                response = self._get_fresh(key)
+
+        if response is None and is_initial_request and self.review_store is not None:
+            # Generated by another worker or before a restart; cached in memory from now on
+            response = await self._get_stored_review(pr_id)
+            if response is not None:
+                await self.set(pr_id, mode, is_initial_request, request, response, persist=False)
+                return response
+
+        if response is None:
+            return None
+        self._record_hit(key, response)
+        return response.model_copy(deep=True)
+
+    async def set(self, pr_id: str, mode: str, is_initial_request: bool, request: str, response: ChatResponse, persist: bool = True):
+        """Store a response for this request."""
+        if persist and is_initial_request and self.review_store is not None:
+            await self._store_review(pr_id, response)
+        scope = self._scope(pr_id, mode, is_initial_request)
+        normalized_request = self._normalize(request)
+        key = self._key(scope, normalized_request)
+
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, response.model_copy(deep=True))
+        hits = self._usage[key][0] if key in self._usage else 0
+        self._usage[key] = (hits + 1, self._priority(hits + 1, response), scope)
+
+        embedding = await self._embed(key, normalized_request) if self.embed_model is not None else None
+
+        # Drop expired entries and keep the scope bounded, evicting the oldest first
+        cached_keys, cached_embeddings = self._scope_entries.get(scope, ([], None))
+        kept = np.array([cached_key != key and self._get_fresh(cached_key) is not None for cached_key in cached_keys], dtype=bool)
+        keys = [cached_key for cached_key, keep in zip(cached_keys, kept) if keep] + [key]
+        if embedding is not None:
+            if cached_embeddings is None:
+                cached_embeddings = np.empty((0, embedding.shape[0]), dtype=np.float32)
+            embeddings = np.vstack([cached_embeddings[kept], embedding])
+        else:
+            embeddings = None
+        for evicted_key in keys[:-self.max_entries_per_scope]:
+            self._entries.pop(evicted_key, None)
+            self._usage.pop(evicted_key, None)
+        self._scope_entries[scope] = (
+            keys[-self.max_entries_per_scope:],
+            embeddings[-self.max_entries_per_scope:] if embeddings is not None else None
+        )
+
+        while len(self._entries) > self.max_entries:
+            self._evict()
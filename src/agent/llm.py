@@ -0,0 +1,18 @@
+import httpx
+from llama_index.llms.openai import OpenAI
+
+LLM_MODEL = "gpt-4"
+
+# One pooled HTTP/2 client for every async OpenAI call (LLMs and embeddings), so connections and TLS sessions are reused.
+# A short connect timeout fails fast on network trouble; generations themselves can take up to a minute.
+shared_async_client = httpx.AsyncClient(
+    http2=True,
+    timeout=httpx.Timeout(60.0, connect=5.0),
+    limits=httpx.Limits(max_connections=200, max_keepalive_connections=100)
+)
+
+shared_llm = OpenAI(model=LLM_MODEL, async_http_client=shared_async_client)
+
+async def close_shared_client():
+    """Close the shared HTTP client. Called on app shutdown."""
+    await shared_async_client.aclose()
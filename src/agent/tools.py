@@ -1,7 +1,17 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from src.agent.base import Tool
 from src.core import rag_utils
 
+# History is stored as (user, assistant) message pairs, so slicing 2 * turns keeps it pair-aligned
+MAX_HISTORY_TURNS = 4
+
+def _history_str(session) -> Optional[str]:
+    """The session's history summary and recent turns as synthesis prompt text, or None when there is no history yet."""
+    rendered_history = "\n".join(list(session.rendered_history)[-MAX_HISTORY_TURNS * 2:])
+    if session.history_summary:
+        return f"Summary of earlier conversation:\n{session.history_summary}\n\nRecent turns:\n{rendered_history}"
+    return rendered_history or None
+
 class RAGSearchTool(Tool):
     """Tool for searching through RAG collections."""
     def __init__(self):
@@ -36,17 +46,14 @@ class RAGSearchTool(Tool):
         else:  # interactive_assistant
             enhanced_query = f"Specific query - {query}"
                 
-        responses = []
-        for collection in collections:
-            if collection in session.collections:
-                response = rag_utils.query_collection(
-                    session.query_engines,
-                    collection,
-                    enhanced_query,
-                    focus
-                )
-                if response:
-                    responses.append(response)
+        # Retrieval only: the agent's synthesis step is the single LLM call over these results.
+        # Repeated searches are served by the collections' retrieval caches.
+        responses = await rag_utils.multi_collection_retrieve(
+            session.query_engines,
+            [collection for collection in collections if collection in session.collections],
+            enhanced_query,
+            focus
+        )
                 
         return {
             "responses": responses,
@@ -82,9 +89,9 @@ class CollectionPlannerTool(Tool):
                 enhanced_query = f"Co-reviewer follow up: {query} - Focus on detailed code review aspects."
         else:  # interactive_assistant
             enhanced_query = f"Interactive assistance: {query} - Focus on specific answers."
-            
-        # Get collection plan
-        plan = rag_utils.get_collection_plan(
+        
+        # Repeats and near-duplicates of this query on the same PR are served from rag_utils' plan caches
+        plan = await rag_utils.aget_collection_plan(
             query=enhanced_query,
             available_collections=session.collections,
             pr_id=pr_id
@@ -131,25 +138,22 @@ class PRSummaryTool(Tool):
             summary_query = "Get key PR information for reference"
             summary_focus = "PR facts and context for specific questions"
             
-        # Use existing RAG functionality to get PR info
-        responses = []
-        for collection in session.collections:
-            response = rag_utils.query_collection(
-                session.query_engines,
-                collection,
-                summary_query,
-                summary_focus
-            )
-            if response:
-                responses.append(response)
+        # Retrieve PR info from every collection; the synthesis below is the only LLM call
+        responses = await rag_utils.multi_collection_retrieve(
+            session.query_engines,
+            session.collections,
+            summary_query,
+            summary_focus
+        )
                 
         # Generate summary using existing synthesis
-        summary = rag_utils.synthesize_co_reviewer_response(
+        summary = await rag_utils.asynthesize_co_reviewer_response(
             summary_query,
             responses,
-            session.chat_history,
+            list(session.chat_history)[-MAX_HISTORY_TURNS * 2:],
             agent_mode,
-            is_initial_review=(mode == "initial" or is_initial_request)
+            is_initial_review=(mode == "initial" or is_initial_request),
+            history_str=_history_str(session)
         )
         
         return {
@@ -188,18 +192,13 @@ class FileAnalysisTool(Tool):
         else:  # interactive_assistant
             query_prefix = "Find specific information about file: "
             
-        # Search for the specific file
-        responses = []
-        for collection in session.collections:
-            if collection.endswith("_source_code"):
-                response = rag_utils.query_collection(
-                    session.query_engines,
-                    collection,
-                    f"{query_prefix}{file_path}",
-                    f"Focus on {analysis_type} aspects of the file"
-                )
-                if response:
-                    responses.append(response)
+        # Retrieval only: the agent's final synthesis is the single LLM call that analyzes the file
+        responses = await rag_utils.multi_collection_retrieve(
+            session.query_engines,
+            [collection for collection in session.collections if collection.endswith("_source_code")],
+            f"{query_prefix}{file_path}",
+            f"Focus on {analysis_type} aspects of the file"
+        )
                     
         return {
             "file_path": file_path,
@@ -231,19 +230,21 @@ class ResponseSynthesisTool(Tool):
         is_initial_request = session_data.get("is_initial_request", False)
         
         if mode == "co_reviewer":
-            result = rag_utils.synthesize_co_reviewer_response(
+            result = await rag_utils.asynthesize_co_reviewer_response(
                 query=query,
                 responses=responses,
-                chat_history=session.chat_history,
+                chat_history=list(session.chat_history)[-MAX_HISTORY_TURNS * 2:],
                 mode=mode,
-                is_initial_review=is_initial_request
+                is_initial_review=is_initial_request,
+                history_str=_history_str(session)
             )
         else:  # interactive_assistant
-            result = rag_utils.synthesize_interactive_response(
+            result = await rag_utils.asynthesize_interactive_response(
                 query=query,
                 responses=responses,
-                chat_history=session.chat_history,
-                mode=mode
+                chat_history=list(session.chat_history)[-MAX_HISTORY_TURNS * 2:],
+                mode=mode,
+                history_str=_history_str(session)
             )
             
         return {
@@ -1,101 +1,103 @@
 import os
-import json
-from typing import Dict, List, Optional
+import re
+import asyncio
+import logging
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
 from fastapi import HTTPException
 import chromadb
-from llama_index.core import StorageContext, load_index_from_storage
+import numpy as np
+import orjson
+from llama_index.core import QueryBundle, StorageContext, load_index_from_storage
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from llama_index.core.storage.index_store import SimpleIndexStore
+from llama_index.core.storage.kvstore import SimpleKVStore
+from llama_index.core.utils import get_tokenizer
+from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.llms.openai import OpenAI
 from llama_index.vector_stores.chroma import ChromaVectorStore
-
-# Function to load index for a specific project
-def load_project_index(pr_id: str) -> Dict:
-    """Loads the index and query engines for a given project ID."""
-    query_engines_for_pr = {}
-    collections_for_pr = []
-    try:
-        # Get absolute path to the specific project's index directory
-        # Assumes this file is in src/core/
-        current_file_dir = os.path.dirname(os.path.abspath(__file__))
-        src_dir = os.path.dirname(current_file_dir)
-        project_root = os.path.dirname(src_dir)
-        project_index_dir = os.path.join(project_root, "indexes", pr_id)
-
-        if not os.path.isdir(project_index_dir):
-            raise FileNotFoundError(f"Index directory not found for project: {pr_id} at {project_index_dir}")
-
-        print(f"Loading index for project '{pr_id}' from {project_index_dir}")
-
-        # Connect to ChromaDB
-        chroma_client = chromadb.PersistentClient(path=project_index_dir)
-        
-        # Get all collections for this project
-        db_collections = chroma_client.list_collections()
-        print(f"Found collections in DB: {[col.name for col in db_collections]}")
-
-        # Create query engines for each collection
-        for collection in db_collections:
-            collection_name = collection.name
-            collections_for_pr.append(collection_name)
-            print(f"Loading collection '{collection_name}'...")
-            
-            try:
-                # Get the collection
-                chroma_collection = chroma_client.get_collection(collection_name)
-                vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-                
-                # Derive storage dir name based on common pattern or specific logic if needed
-                # Assuming storage dir is named like 'storage_suffix' where collection is 'project_id_suffix'
-                suffix = collection_name.replace(pr_id + '_', '')
-                storage_dir = os.path.join(project_index_dir, f"storage_{suffix}")
-                
-                # Check if storage directory exists and has required files
-                if not os.path.exists(storage_dir) or not os.path.exists(os.path.join(storage_dir, "docstore.json")):
-                    print(f"⚠️  Storage files missing for collection '{collection_name}' at {storage_dir}, skipping...")
-                    continue
-                    
-                storage_context = StorageContext.from_defaults(vector_store=vector_store, persist_dir=storage_dir)
-                index = load_index_from_storage(storage_context)
-                retriever = index.as_retriever(similarity_top_k=3) # Default top_k
-                query_engine = index.as_query_engine(llm=OpenAI(model="gpt-4"))
-                
-                query_engines_for_pr[collection_name] = {
-                    "engine": query_engine,
-                    "retriever": retriever
-                }
-                print(f"✅ Collection '{collection_name}' loaded successfully!")
-            except Exception as e:
-                print(f"⚠️  Error loading collection '{collection_name}': {e}")
-                continue
-
-        if not query_engines_for_pr:
-            raise ValueError(f"No collections were successfully loaded for project {pr_id}.")
-        else:
-            print(f"✅ Successfully loaded {len(query_engines_for_pr)} collections for {pr_id}: {list(query_engines_for_pr.keys())}")
-        
-        return {"query_engines": query_engines_for_pr, "collections": collections_for_pr}
-
-    except Exception as e:
-        print(f"❌ Error initializing project '{pr_id}': {e}")
-        # Re-raise the exception to be caught by the endpoint
-        raise HTTPException(status_code=500, detail=f"Error loading index for project {pr_id}: {str(e)}")
-
-# RAG Planning Function
-def get_collection_plan(query: str, available_collections: List[str], pr_id: str) -> Dict:
-    """Have the LLM analyze the query and determine which collections to query."""
-    # Note: Using available_collections passed from the session
-    
-    print("\n" + "="*80)
-    print("COLLECTION PLANNING PHASE")
-    print("="*80)
-    print(f"User Query: {query}")
-    print(f"Available Collections: {available_collections}")
-    print(f"PR ID: {pr_id}")
-    
-    system_prompt = f"""You are a Code Review Assistant with access to these specific collections for PR '{pr_id}':
-{', '.join(available_collections)}
-
-You are working with structured pull request (PR) data. Assume the collections contain relevant PR data, code diffs, and requirements based on their names (e.g., {pr_id}_pr_data, {pr_id}_code, {pr_id}_requirements).
+from src.agent.llm import LLM_MODEL, shared_async_client
+
+logger = logging.getLogger(__name__)
+
+# Collection routing is a small structured decision, so it runs on a cheaper, faster model in JSON mode
+PLANNER_MODEL = "gpt-4o-mini"
+
+# Nodes retrieved per collection query
+SIMILARITY_TOP_K = 5
+# Nodes kept across all collections by multi_collection_retrieve, best scores first
+MULTI_COLLECTION_TOP_K = 10
+# Tokens of retrieved text one multi_collection_retrieve call may contribute to the synthesis prompt,
+# so a few huge chunks can't crowd out the history and instructions in GPT-4's 8k context
+RETRIEVAL_TOKEN_BUDGET = 3000
+# Broad queries ("list all changed files", "summary of the PR") retrieve twice as many nodes
+BROAD_QUERY_WORDS = frozenset({"list", "all", "every", "each", "summary", "summarize", "overview"})
+BROAD_QUERY_TOP_K_FACTOR = 2
+# Retrieved nodes kept per collection for repeated queries (the index doesn't change under a handle)
+RETRIEVAL_CACHE_TTL_SECONDS = 600
+RETRIEVAL_CACHE_MAX_ENTRIES = 256
+# Collections that haven't answered within this many seconds are left out of the results, so one slow
+# collection (e.g. loading from a cold disk) doesn't hold up the whole turn
+COLLECTION_RETRIEVAL_TIMEOUT_SECONDS = 10
+# Query embeddings by (embedding model, query digest), least recently used first. Lets the same query
+# skip the embedding call on a collection set or top_k it hasn't been retrieved with yet. Only used on the event loop.
+QUERY_EMBEDDING_CACHE_MAX_ENTRIES = 1024
+_QUERY_EMBEDDING_CACHE: OrderedDict[Tuple[Tuple, str], List[float]] = OrderedDict()
+# Characters of a source node's text shown in its preview
+SOURCE_PREVIEW_CHARS = 200
+
+# Per-PR index directories live in <project root>/indexes; this file is in src/core/
+INDEXES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "indexes")
+
+# Loaded project indexes by PR ID, as (index signature, load_project_index result)
+_PR_INDEX_CACHE: Dict[str, Tuple[float, Dict]] = {}
+_PR_INDEX_CACHE_LOCK = threading.Lock()
+
+# One Chroma client per index directory, shared by every load and session of that PR
+_CHROMA_CLIENTS: Dict[str, Any] = {}
+_CHROMA_CLIENTS_LOCK = threading.Lock()
+
+# Collection plans as orjson bytes by (PR, digest of canonical query and collections), least recently used first.
+# Decoding the bytes gives each caller its own plan, faster than deep-copying a dict.
+PLAN_CACHE_MAX_ENTRIES = 512
+_PLAN_CACHE: OrderedDict[Tuple[str, str], bytes] = OrderedDict()
+# Hit and miss counts across both plan caches plus exact-cache evictions and keyword-routed plans,
+# for tuning sizes, PLAN_SIMILARITY_THRESHOLD and KEYWORD_ROUTES
+_PLAN_CACHE_STATS: Dict[str, int] = {"hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "keyword_routes": 0}
+_PLAN_CACHE_LOCK = threading.Lock()
+
+# Near-duplicate queries ("what files changed?" / "list changed files") reuse a plan when their
+# embeddings' cosine similarity reaches PLAN_SIMILARITY_THRESHOLD. Guarded by _PLAN_CACHE_LOCK.
+PLAN_EMBED_MODEL = "text-embedding-3-small"
+PLAN_SIMILARITY_THRESHOLD = 0.95
+PLAN_SEMANTIC_CACHE_MAX_ENTRIES = 256
+# (PR ID, sorted collections) -> (normalized query embeddings as an (N, dim) matrix, their plans as orjson bytes), oldest first
+_PLAN_SEMANTIC_CACHE: Dict[Tuple[str, Tuple[str, ...]], Tuple[np.ndarray, List[bytes]]] = {}
+
+WORD_PATTERN = re.compile(r"\w+")
+PUNCTUATION_PATTERN = re.compile(r"[^\w\s]")
+
+# Unambiguous queries are planned without an LLM call: (query pattern, collection name markers).
+# A route applies when exactly one pattern matches and some collection names contain one of its markers.
+# Per-file diffs are indexed from fetch_pr_data.py's output, so diff queries also search the pr_data collection.
+KEYWORD_ROUTES = (
+    (re.compile(r"\b(?:diffs?|patch(?:es)?)\b", re.I), ("pr_data", "code")),
+    (re.compile(r"\bsource code\b", re.I), ("code",)),
+    (re.compile(r"\b(?:requirements?|specs?|specifications?)\b", re.I), ("requirement", "spec")),
+)
+
+# Planning prompt. Everything that varies per PR comes last, after the static instructions, so the
+# prompt prefix is identical across PRs and requests and can be served from OpenAI's prompt cache.
+COLLECTION_PLAN_PROMPT = """You are a Code Review Assistant with access to a specific set of collections for one pull request, listed at the end.
+
+You are working with structured pull request (PR) data. Assume the collections contain relevant PR data, code diffs, and requirements based on their names (e.g., <pr_id>_pr_data, <pr_id>_code, <pr_id>_requirements).
 
 Each indexed PR might contain fields like:
 - "pr_number" (int): The pull request number
@@ -112,7 +114,7 @@ Each indexed PR might contain fields like:
   - "diff" (string): Full unified diff format (git-style)
 
 Your task is to analyze the user's query and determine which collections to query.
-IMPORTANT: You MUST ONLY use the exact collection names listed in `available_collections`.
+IMPORTANT: You MUST ONLY use the exact collection names listed under "Available collections".
 
 Analyze the user's query and determine:
 1. Which collections from the available ones are relevant
@@ -128,35 +130,400 @@ Return your analysis as a JSON object with:
 - collections: List of collections to query (MUST match exact names from the available collections)
 - reasoning: Brief explanation of why each collection is needed
 - search_focus: What to look for in each collection, including specific fields to examine
+
+Available collections for PR '{pr_id}':
+{collections}
 """
+
+# Synthesis prompt templates, formatted with the values built by _co_reviewer_prompt / _interactive_prompt
+CO_REVIEWER_INITIAL_PROMPT = """You are a Code Review Assistant generating an initial review summary.
+Your task is to create a structured code review summary based on the provided context.
+
+Available Information (Extracted from PR data, code, requirements):
+{formatted_responses}
+
+Additional Context:
+PR Metadata: {pr_metadata}
+File Changes: {file_changes}
+
+Instructions:
+1.  **Extract key details** (like PR number, title, author, status) from the PR Metadata section.
+2.  Generate a structured multi-aspect code review summary using this Markdown format:
+    ```markdown
+    ## Initial Code Review Summary: PR {{pr_number}} - {{pr_title}}
+
+    **Author:** {{extracted_author}}
+    **Status:** {{extracted_status}}
+
+    **1. Overview:**
+    [Briefly summarize the PR's purpose based on the description found in the available information.]
+
+    **2. Key Changes:**
+    [Summarize the main file changes and the nature of diffs based on the File Changes section. Mention key added/modified files.]
+
+    **3. Potential Areas for Focus:**
+    [Based on the provided info, suggest 1-2 general areas the user might want to look closer at, e.g., specific complex files, security aspects if mentioned, or major logic changes.]
+
+    **4. Next Steps:**
+    Please ask follow-up questions about specific files, logic, or concerns.
+    ```
+3.  **If certain information is missing, state that clearly instead of refusing.** Example: "I have retrieved some initial information, but crucial details like [missing detail] were not found in the available context. Here's what I could gather: [Provide partial summary]." Fill the template fields with "[Data not available]" if specific data points are missing.
+
+Initial Review Summary:"""
+
+CO_REVIEWER_FOLLOWUP_PROMPT = """You are a Code Review Assistant in 'co_reviewer' mode, responding to a follow-up query.
+Your task is to provide a concise, helpful answer based on the chat history and newly retrieved information.
+
+Chat History:
+{history_str}
+
+Available New Information (Extracted for the latest query):
+{formatted_responses}
+
+Additional Context:
+PR Metadata: {pr_metadata}
+File Changes: {file_changes}
+
+User Query: {query}
+
+Instructions:
+1.  Analyze the User Query in the context of the Chat History.
+2.  Use the Available New Information and Additional Context sections to answer the query.
+3.  If the query is about a specific file, check the File Changes section first.
+4.  Provide a clear, conversational response directly addressing the query.
+
+Assistant Response:"""
+
+INTERACTIVE_PROMPT = """You are an Interactive Code Assistant.
+Your task is to provide helpful answers to the user's query based on the chat history and newly retrieved information.
+
+Chat History:
+{history_str}
+
+Available New Information (Extracted for the latest query):
+{formatted_responses}
+
+User Query: {query}
+
+Instructions:
+1.  Analyze the User Query in the context of the Chat History.
+2.  Use the Available New Information section and the history to formulate your answer.
+3.  Provide a clear, conversational, and helpful response.
+
+Assistant Response:"""
+
+# Folds the turns that fall out of a session's verbatim history into its rolling summary
+HISTORY_SUMMARY_PROMPT = """Update the summary of an earlier code review conversation with the exchange below.
+Keep the PR details, files, findings and open questions that later questions may refer to. Reply with the updated summary only, in at most 150 words.
+
+Current summary:
+{summary}
+
+Exchange:
+{exchange}
+
+Updated summary:"""
+
+@lru_cache(maxsize=8)
+def get_llm(model: str = LLM_MODEL) -> OpenAI:
+    """Shared LLM per model for response synthesis.
+    All of them send async calls through the agent's pooled HTTP/2 client."""
+    return OpenAI(model=model, async_http_client=shared_async_client)
+
+@lru_cache(maxsize=1)
+def get_planner_llm() -> OpenAI:
+    """Shared planner LLM. Each call passes the PR's plan schema as its response_format.
+    Temperature 0 so the same query gets the same plan, which is also what the plan caches assume."""
+    return OpenAI(model=PLANNER_MODEL, temperature=0, async_http_client=shared_async_client)
+
+def get_plan_embed_model() -> BaseEmbedding:
+    """Shared embedding model for the planner's semantic cache."""
+    return _shared_embed_model("openai", PLAN_EMBED_MODEL, None)
+
+def _index_signature(project_index_dir: str) -> float:
+    """Latest mtime across the index directory and its immediate subdirectories' files.
+    Re-indexing rewrites chroma.sqlite3 and the storage_* files, which bumps this value."""
+    latest = os.stat(project_index_dir).st_mtime
+    with os.scandir(project_index_dir) as entries:
+        for entry in entries:
+            latest = max(latest, entry.stat().st_mtime)
+            if entry.is_dir():
+                with os.scandir(entry.path) as sub_entries:
+                    for sub_entry in sub_entries:
+                        latest = max(latest, sub_entry.stat().st_mtime)
+    return latest
+
+def project_index_signature(pr_id: str) -> Optional[float]:
+    """The signature of the PR's index as last loaded by this process, or None if it isn't loaded."""
+    with _PR_INDEX_CACHE_LOCK:
+        cached = _PR_INDEX_CACHE.get(pr_id)
+    return cached[0] if cached else None
+
+def invalidate_project_index(pr_id: str):
+    """Drop a cached project index, and the PR's cached plans, so the next load reads it from disk."""
+    with _PR_INDEX_CACHE_LOCK:
+        _PR_INDEX_CACHE.pop(pr_id, None)
+    with _PLAN_CACHE_LOCK:
+        for key in [key for key in _PLAN_CACHE if key[0] == pr_id]:
+            del _PLAN_CACHE[key]
+        for scope in [scope for scope in _PLAN_SEMANTIC_CACHE if scope[0] == pr_id]:
+            del _PLAN_SEMANTIC_CACHE[scope]
+
+def plan_cache_stats() -> Dict[str, int]:
+    """A snapshot of the plan caches' hit, miss and eviction counts."""
+    with _PLAN_CACHE_LOCK:
+        return dict(_PLAN_CACHE_STATS)
+
+def get_embed_model(collection_metadata: Optional[Dict]) -> Optional[BaseEmbedding]:
+    """Build the embedding model a collection was indexed with, from its Chroma metadata.
+    Returns None for collections indexed before this metadata was recorded (uses the global default)."""
+    if not collection_metadata or "embed_provider" not in collection_metadata:
+        return None
+    return _shared_embed_model(
+        collection_metadata["embed_provider"],
+        collection_metadata["embed_model"],
+        collection_metadata.get("embed_dimensions")
+    )
+
+@lru_cache(maxsize=None)
+def _shared_embed_model(provider: str, model: str, dimensions: Optional[int]) -> BaseEmbedding:
+    """One embedding model instance per (provider, model, dimensions), shared by every collection that uses it."""
+    if provider == "huggingface":
+        # Imported lazily so the API only needs torch when HF-embedded indexes are served
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+        return HuggingFaceEmbedding(model_name=model)
+    return OpenAIEmbedding(model=model, dimensions=dimensions, async_http_client=shared_async_client)
+
+def _load_kvstore(persist_path: str) -> SimpleKVStore:
+    """Read a persisted LlamaIndex key-value store with orjson, several times faster than the stdlib
+    json parser LlamaIndex uses for the multi-MB docstores."""
+    with open(persist_path, "rb") as f:
+        return SimpleKVStore(orjson.loads(f.read()))
+
+@dataclass
+class CollectionHandle:
+    """A collection found on disk. Its index and retriever are built on first use,
+    so a session only pays for the collections its queries actually touch."""
+    collection_name: str
+    storage_dir: str
+    chroma_client: Any
+    # The listed Collection on Chroma < 0.6, fetched on load otherwise
+    chroma_collection: Any
+    _retriever: Any = field(default=None, init=False, repr=False)
+    _index: Any = field(default=None, init=False, repr=False)
+    # (query digest, top_k) -> (expires_at, retrieved nodes), oldest first. Only used on the event loop.
+    _retrieval_cache: OrderedDict = field(default_factory=OrderedDict, init=False, repr=False)
+    # (query digest, top_k) -> retrieval in flight, joined by concurrent identical queries. Only used on the event loop.
+    _inflight: Dict = field(default_factory=dict, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def load(self):
+        """Build the index and retriever unless already built. Safe to call from several threads."""
+        with self._lock:
+            if self._retriever is not None:
+                return
+            logger.debug("Loading collection '%s'...", self.collection_name)
+            if self.chroma_collection is None:
+                self.chroma_collection = self.chroma_client.get_collection(self.collection_name)
+            vector_store = ChromaVectorStore(chroma_collection=self.chroma_collection)
+            storage_context = StorageContext.from_defaults(
+                docstore=SimpleDocumentStore(_load_kvstore(os.path.join(self.storage_dir, "docstore.json"))),
+                index_store=SimpleIndexStore(_load_kvstore(os.path.join(self.storage_dir, "index_store.json"))),
+                vector_store=vector_store,
+                persist_dir=self.storage_dir
+            )
+            index = load_index_from_storage(
+                storage_context, embed_model=get_embed_model(self.chroma_collection.metadata)
+            )
+            self._index = index
+            self._retriever = index.as_retriever(similarity_top_k=SIMILARITY_TOP_K)
+            logger.info("Collection '%s' loaded successfully", self.collection_name)
+
+    @property
+    def loaded(self) -> bool:
+        return self._retriever is not None
+
+    async def aload(self):
+        """Load in a worker thread so the disk reads don't block the event loop."""
+        if self._retriever is None:
+            await asyncio.to_thread(self.load)
+
+    @property
+    def retriever(self):
+        if self._retriever is None:
+            self.load()
+        return self._retriever
+
+    def retriever_for(self, similarity_top_k: int):
+        """The shared retriever, or a new one over the same index for another top_k.
+        Retrievers hold no data, so this is cheap and leaves the shared one untouched."""
+        if similarity_top_k == SIMILARITY_TOP_K:
+            return self.retriever
+        if self._retriever is None:
+            self.load()
+        return self._index.as_retriever(similarity_top_k=similarity_top_k)
+
+    def cached_nodes(self, key: Tuple[str, int]) -> Optional[List]:
+        """Nodes retrieved earlier for the same query and top_k, if still fresh."""
+        cached = self._retrieval_cache.get(key)
+        if cached is None or cached[0] < time.monotonic():
+            return None
+        self._retrieval_cache.move_to_end(key)
+        return cached[1]
+
+    def cache_nodes(self, key: Tuple[str, int], nodes: List):
+        self._retrieval_cache[key] = (time.monotonic() + RETRIEVAL_CACHE_TTL_SECONDS, nodes)
+        self._retrieval_cache.move_to_end(key)
+        if len(self._retrieval_cache) > RETRIEVAL_CACHE_MAX_ENTRIES:
+            self._retrieval_cache.popitem(last=False)
+
+    async def aretrieve_once(self, key: Tuple[str, int], retrieve: Callable[[], Awaitable[List]]) -> List:
+        """Run retrieve() for the key, or join the identical retrieval already in flight, and cache its nodes.
+        Concurrent sessions asking the same question (e.g. every new session's initial review) then share one
+        embedding call and one vector search instead of each missing the cache."""
+        future = self._inflight.get(key)
+        if future is None:
+            async def retrieve_and_cache() -> List:
+                nodes = await retrieve()
+                self.cache_nodes(key, nodes)
+                return nodes
+            future = asyncio.ensure_future(retrieve_and_cache())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded: a caller that times out must not cancel the retrieval for the others
+        return await asyncio.shield(future)
+
+def get_chroma_client(project_index_dir: str):
+    """The shared PersistentClient for an index directory, opened on first use.
+    Reloads after re-indexing reuse it instead of opening another SQLite handle on the same files."""
+    with _CHROMA_CLIENTS_LOCK:
+        chroma_client = _CHROMA_CLIENTS.get(project_index_dir)
+        if chroma_client is None:
+            chroma_client = _CHROMA_CLIENTS[project_index_dir] = chromadb.PersistentClient(path=project_index_dir)
+        return chroma_client
+
+# Function to load index for a specific project
+def load_project_index(pr_id: str) -> Dict:
+    """Finds the collections for a given project ID. Each collection's index is loaded on first use."""
+    query_engines_for_pr = {}
+    try:
+        # Get absolute path to the specific project's index directory
+        project_index_dir = os.path.join(INDEXES_DIR, pr_id)
+
+        if not os.path.isdir(project_index_dir):
+            raise FileNotFoundError(f"Index directory not found for project: {pr_id} at {project_index_dir}")
+
+        # Reuse the already-found collections (and any indexes loaded since) unless the index changed on disk
+        signature = _index_signature(project_index_dir)
+        with _PR_INDEX_CACHE_LOCK:
+            cached = _PR_INDEX_CACHE.get(pr_id)
+        if cached and cached[0] == signature:
+            # Fresh containers per caller; the collection handles themselves are shared
+            return {"query_engines": dict(cached[1]["query_engines"]), "collections": list(cached[1]["collections"])}
+
+        logger.info("Loading index for project '%s' from %s", pr_id, project_index_dir)
+
+        # Connect to ChromaDB
+        chroma_client = get_chroma_client(project_index_dir)
+        
+        # Get all collections for this project
+        db_collections = chroma_client.list_collections()
+        # Chroma < 0.6 lists Collection objects (reused as-is), 0.6+ lists names only
+        if db_collections and isinstance(db_collections[0], str):
+            collections_for_pr = list(db_collections)
+            listed_handles = [None] * len(db_collections)
+        else:
+            collections_for_pr = [col.name for col in db_collections]
+            listed_handles = db_collections
+        logger.debug("Found collections in DB: %s", collections_for_pr)
+
+        collection_prefix = f"{pr_id}_"
+        for collection_name, chroma_collection in zip(collections_for_pr, listed_handles):
+            # Derive storage dir name based on common pattern or specific logic if needed
+            # Assuming storage dir is named like 'storage_suffix' where collection is 'project_id_suffix'
+            suffix = collection_name.removeprefix(collection_prefix)
+            storage_dir = os.path.join(project_index_dir, f"storage_{suffix}")
+            
+            # Check the storage directory has a non-empty docstore (one stat covers the directory too)
+            try:
+                docstore_size = os.stat(os.path.join(storage_dir, "docstore.json")).st_size
+            except FileNotFoundError:
+                docstore_size = 0
+            if not docstore_size:
+                logger.warning("Storage files missing for collection '%s' at %s, skipping...", collection_name, storage_dir)
+                continue
+            
+            query_engines_for_pr[collection_name] = CollectionHandle(
+                collection_name=collection_name,
+                storage_dir=storage_dir,
+                chroma_client=chroma_client,
+                chroma_collection=chroma_collection
+            )
+
+        if not query_engines_for_pr:
+            raise ValueError(f"No collections were successfully loaded for project {pr_id}.")
+        else:
+            logger.info("Found %d collections for %s: %s", len(query_engines_for_pr), pr_id, list(query_engines_for_pr))
+        
+        index_data = {"query_engines": query_engines_for_pr, "collections": collections_for_pr}
+        with _PR_INDEX_CACHE_LOCK:
+            _PR_INDEX_CACHE[pr_id] = (signature, index_data)
+        return {"query_engines": dict(query_engines_for_pr), "collections": list(collections_for_pr)}
+
+    except FileNotFoundError as e:
+        # An unknown PR is the client's error, not the server's
+        logger.warning("%s", e)
+        raise HTTPException(status_code=404, detail=f"No index found for project {pr_id}")
+    except Exception as e:
+        logger.error("Error initializing project '%s': %s", pr_id, e)
+        # Re-raise the exception to be caught by the endpoint
+        raise HTTPException(status_code=500, detail=f"Error loading index for project {pr_id}: {str(e)}")
+
+@lru_cache(maxsize=256)
+def _planning_system_prompt(pr_id: str, available_collections: Tuple[str, ...]) -> str:
+    """The planning system prompt for a PR's collections, built once per PR session."""
+    return COLLECTION_PLAN_PROMPT.format(pr_id=pr_id, collections=', '.join(available_collections))
+
+@lru_cache(maxsize=256)
+def _plan_response_format(available_collections: Tuple[str, ...]) -> Dict:
+    """Structured-output schema for a plan. Collections are an enum of the PR's own, so the model can't name others."""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "collection_plan",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "collections": {"type": "array", "items": {"type": "string", "enum": list(available_collections)}},
+                    "reasoning": {"type": "string"},
+                    "search_focus": {"type": "string"}
+                },
+                "required": ["collections", "reasoning", "search_focus"],
+                "additionalProperties": False
+            }
+        }
+    }
+
+def _collection_plan_prompt(query: str, available_collections: List[str], pr_id: str) -> str:
+    """Build the planning prompt for the query."""
+    logger.debug("Collection planning - query: %s, available collections: %s, PR ID: %s", query, available_collections, pr_id)
     
-    print("\n" + "-"*40)
-    print("SYSTEM PROMPT SENT TO GPT-4")
-    print("-"*40)
-    print(system_prompt)
-    print("\nUser Query:", query)
-    print("-"*40 + "\n")
+    system_prompt = _planning_system_prompt(pr_id, tuple(available_collections))
     
-    llm = OpenAI(model="gpt-4")
-    response = llm.complete(
-        system_prompt + f"\n\nUser Query: {query}\n\nAnalysis:"
-    )
+    logger.debug("Planning system prompt:\n%s", system_prompt)
     
-    print("\n" + "-"*40)
-    print("GPT-4 RESPONSE")
-    print("-"*40)
-    print(str(response))
-    print("-"*40 + "\n")
+    return system_prompt + f"\n\nUser Query: {query}\n\nAnalysis:"
+
+def _parse_collection_plan(response_text: str, available_collections: List[str]) -> Dict:
+    """Parse the LLM's plan and keep only valid collections.
+    Falling back to all of them is defense in depth: the structured-output schema only admits valid plans,
+    but the model may still refuse or pick no collection."""
+    logger.debug("Planning response:\n%s", response_text)
     
     try:
         # Try to parse the response as JSON
-        plan = json.loads(str(response))
-        
-        print("\n" + "-"*40)
-        print("PARSED PLAN")
-        print("-"*40)
-        print(json.dumps(plan, indent=2))
-        print("-"*40 + "\n")
+        plan = orjson.loads(response_text)
         
         # Validate that the collections exist
         valid_collections = []
@@ -164,95 +531,214 @@ Return your analysis as a JSON object with:
             if collection in available_collections:
                 valid_collections.append(collection)
             else:
-                print(f"⚠️  LLM suggested invalid collection '{collection}', removing it")
+                logger.warning("LLM suggested invalid collection '%s', removing it", collection)
         
         if not valid_collections:
             # If no valid collections, use all available ones
             plan["collections"] = available_collections
             plan["reasoning"] = "Using all available collections as no specific ones were determined or validated"
             plan["search_focus"] = "General information"
-            print("\n" + "⚠️"*20)
-            print("NO VALID COLLECTIONS FOUND - USING ALL AVAILABLE")
-            print("⚠️"*20 + "\n")
+            logger.warning("No valid collections found in plan, using all available")
         else:
             plan["collections"] = valid_collections
             
-        print("\n" + "-"*40)
-        print("FINAL VALIDATED PLAN")
-        print("-"*40)
-        print(json.dumps(plan, indent=2))
-        print("="*80 + "\n")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Final validated plan:\n%s", orjson.dumps(plan, option=orjson.OPT_INDENT_2).decode())
         
         return plan
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         # If not valid JSON, create a default plan using all available collections
-        print("\n" + "❌"*20)
-        print("JSON PARSING ERROR - USING DEFAULT PLAN")
-        print("❌"*20 + "\n")
+        logger.warning("Could not parse collection plan as JSON, using default plan")
         return {
             "collections": available_collections,
             "reasoning": "Could not parse LLM response for collection plan, using all available collections",
             "search_focus": "General information"
         }
 
-# RAG Querying Function
-def query_collection(session_query_engines: Dict, collection_name: str, query: str, focus: str) -> Optional[Dict]:
-    """Query a specific collection using the session's query engine."""
-    if collection_name not in session_query_engines:
-        print(f"Error: Collection '{collection_name}' not found in session query engines.")
-        return None
-        
-    try:
-        print(f"Querying collection '{collection_name}' with query: {query}")
-        
-        # Add focus to the query for better context
-        focused_query = f"""{query}
+def _canonical_query(query: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace so trivially different queries share a plan."""
+    return " ".join(PUNCTUATION_PATTERN.sub(" ", query.lower()).split())
 
-Focus on: {focus}"""
-        
-        # For source code queries, add file path filtering
-        if collection_name.endswith("_source_code") and "file" in query.lower():
-            import re
-            file_path_match = re.search(r'ogen-main/.*?\.(yml|yaml|json|py|go|ts|js|java|cpp|h|hpp)', query)
-            if file_path_match:
-                file_path = file_path_match.group(0)
-                focused_query += f"\n\nSpecifically look for file: {file_path}"
-        
-        similarity_top_k = 5
-        
-        query_engine_info = session_query_engines[collection_name]
-        query_engine = query_engine_info["engine"]
-        retriever = query_engine_info["retriever"]
-        retriever.similarity_top_k = similarity_top_k
-        
-        response = query_engine.query(focused_query)
-        
-        # Extract sources metadata
-        sources = []
-        if hasattr(response, "source_nodes"):
-            for node in response.source_nodes:
-                metadata = getattr(node, "metadata", {})
-                text = getattr(node, "text", "")
-                text_preview = text[:200] + "..." if len(text) > 200 else text
-                source_info = {"text_preview": text_preview}
-                if metadata:
-                    source_info.update(metadata)
-                sources.append(source_info)
+def _plan_cache_key(query: str, available_collections: List[str], pr_id: str) -> Tuple[str, str]:
+    key = "\x00".join([_canonical_query(query), *sorted(available_collections)])
+    return (pr_id, hashlib.blake2b(key.encode(), digest_size=16).hexdigest())
 
+def _get_cached_plan(query: str, available_collections: List[str], pr_id: str) -> Optional[Dict]:
+    """Return a plan that needs no LLM call: the only collection, a keyword route, or a copy of a cached plan."""
+    if len(available_collections) == 1:
         return {
-            "answer": str(response),
-            "sources": sources,
-            "collection": collection_name
+            "collections": list(available_collections),
+            "reasoning": "Only one collection is available",
+            "search_focus": "General information"
         }
-    except Exception as e:
-        print(f"Error querying collection '{collection_name}': {e}")
+    plan = _keyword_plan(query, available_collections)
+    if plan is not None:
+        return plan
+    key = _plan_cache_key(query, available_collections, pr_id)
+    with _PLAN_CACHE_LOCK:
+        plan = _PLAN_CACHE.get(key)
+        if plan is None:
+            return None
+        _PLAN_CACHE.move_to_end(key)
+        _PLAN_CACHE_STATS["hits"] += 1
+    return orjson.loads(plan)
+
+def _keyword_plan(query: str, available_collections: List[str]) -> Optional[Dict]:
+    """Route the query by KEYWORD_ROUTES, or return None when it's ambiguous and needs the planner."""
+    matched = [markers for pattern, markers in KEYWORD_ROUTES if pattern.search(query)]
+    if len(matched) != 1:
+        return None
+    collections = [name for name in available_collections if any(marker in name.lower() for marker in matched[0])]
+    if not collections:
         return None
+    with _PLAN_CACHE_LOCK:
+        _PLAN_CACHE_STATS["keyword_routes"] += 1
+    return {
+        "collections": collections,
+        "reasoning": "Routed by keyword",
+        "search_focus": query
+    }
 
-# RAG Synthesis Function for Co-Reviewer Mode
-def synthesize_co_reviewer_response(query: str, responses: List[Dict], chat_history: List[Dict], mode: str, is_initial_review: bool) -> Dict:
-    """Synthesize responses for co-reviewer mode (initial or follow-up)."""
+def _cache_plan(query: str, available_collections: List[str], pr_id: str, plan: Dict):
+    with _PLAN_CACHE_LOCK:
+        _PLAN_CACHE[_plan_cache_key(query, available_collections, pr_id)] = orjson.dumps(plan)
+        if len(_PLAN_CACHE) > PLAN_CACHE_MAX_ENTRIES:
+            _PLAN_CACHE.popitem(last=False)
+            _PLAN_CACHE_STATS["evictions"] += 1
+
+def _plan_scope(available_collections: List[str], pr_id: str) -> Tuple[str, Tuple[str, ...]]:
+    return (pr_id, tuple(sorted(available_collections)))
+
+def normalized_embedding(embedding: List[float]) -> np.ndarray:
+    """The embedding as a float32 unit vector, so a dot product with another one is their cosine similarity."""
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def _get_similar_plan(query_embedding: np.ndarray, available_collections: List[str], pr_id: str) -> Optional[Dict]:
+    """Return a copy of the plan cached for the most similar earlier query, if it is similar enough."""
+    with _PLAN_CACHE_LOCK:
+        cached = _PLAN_SEMANTIC_CACHE.get(_plan_scope(available_collections, pr_id))
+        if cached is None:
+            return None
+        embeddings, plans = cached
+        # Rows and query are unit vectors, so one matrix-vector product gives every cosine similarity
+        similarities = embeddings @ query_embedding
+        best = int(similarities.argmax())
+        if similarities[best] < PLAN_SIMILARITY_THRESHOLD:
+            return None
+        plan = plans[best]
+        _PLAN_CACHE_STATS["semantic_hits"] += 1
+    return orjson.loads(plan)
+
+def _count_plan_miss():
+    with _PLAN_CACHE_LOCK:
+        _PLAN_CACHE_STATS["misses"] += 1
+
+def _cache_similar_plan(query_embedding: np.ndarray, available_collections: List[str], pr_id: str, plan: Dict):
+    scope = _plan_scope(available_collections, pr_id)
+    with _PLAN_CACHE_LOCK:
+        embeddings, plans = _PLAN_SEMANTIC_CACHE.get(scope, (np.empty((0, query_embedding.shape[0]), dtype=np.float32), []))
+        # Evict the oldest entries once the scope is full
+        _PLAN_SEMANTIC_CACHE[scope] = (
+            np.vstack([embeddings, query_embedding])[-PLAN_SEMANTIC_CACHE_MAX_ENTRIES:],
+            (plans + [orjson.dumps(plan)])[-PLAN_SEMANTIC_CACHE_MAX_ENTRIES:]
+        )
+
+# RAG Planning Function
+def get_collection_plan(query: str, available_collections: List[str], pr_id: str) -> Dict:
+    """Have the LLM analyze the query and determine which collections to query."""
+    # Note: Using available_collections passed from the session
+    plan = _get_cached_plan(query, available_collections, pr_id)
+    if plan is not None:
+        return plan
+    
+    try:
+        query_embedding = normalized_embedding(get_plan_embed_model().get_query_embedding(query.strip()))
+        plan = _get_similar_plan(query_embedding, available_collections, pr_id)
+    except Exception as e:
+        # The semantic cache is an optimization; plan without it
+        logger.warning("Could not embed query for the plan cache: %s", e)
+        query_embedding = None
+    
+    if plan is None:
+        _count_plan_miss()
+        response = get_planner_llm().complete(
+            _collection_plan_prompt(query, available_collections, pr_id),
+            response_format=_plan_response_format(tuple(available_collections))
+        )
+        plan = _parse_collection_plan(str(response), available_collections)
+        if query_embedding is not None:
+            _cache_similar_plan(query_embedding, available_collections, pr_id, plan)
+    _cache_plan(query, available_collections, pr_id, plan)
+    return plan
+
+async def aget_collection_plan(query: str, available_collections: List[str], pr_id: str) -> Dict:
+    """Async variant of get_collection_plan."""
+    plan = _get_cached_plan(query, available_collections, pr_id)
+    if plan is not None:
+        return plan
+    
+    try:
+        query_embedding = normalized_embedding(await get_plan_embed_model().aget_query_embedding(query.strip()))
+        plan = _get_similar_plan(query_embedding, available_collections, pr_id)
+    except Exception as e:
+        logger.warning("Could not embed query for the plan cache: %s", e)
+        query_embedding = None
     
-    history_str = "\n".join([f"{msg['role']}: {msg['content']}" for msg in chat_history])
+    if plan is None:
+        _count_plan_miss()
+        response = await get_planner_llm().acomplete(
+            _collection_plan_prompt(query, available_collections, pr_id),
+            response_format=_plan_response_format(tuple(available_collections))
+        )
+        plan = _parse_collection_plan(str(response), available_collections)
+        if query_embedding is not None:
+            _cache_similar_plan(query_embedding, available_collections, pr_id, plan)
+    _cache_plan(query, available_collections, pr_id, plan)
+    return plan
+
+def _retrieval_top_k_factor(query: str) -> int:
+    """How many times the default number of nodes to retrieve for the query.
+    A keyword heuristic rather than an LLM call, so picking top_k costs nothing."""
+    if BROAD_QUERY_WORDS.isdisjoint(WORD_PATTERN.findall(query.lower())):
+        return 1
+    return BROAD_QUERY_TOP_K_FACTOR
+
+def _source_info(node) -> Dict:
+    """Build the sources entry for a retrieved node."""
+    # NodeWithScore always has text and metadata, so no getattr defaults are needed
+    text = node.text or ""
+    text_preview = text[:SOURCE_PREVIEW_CHARS] + "..." if len(text) > SOURCE_PREVIEW_CHARS else text
+    # Metadata keys win over the preview, as before
+    return {"text_preview": text_preview, **(node.metadata or {})}
+
+async def aupdate_history_summary(summary: str, messages: List[Dict]) -> str:
+    """Fold messages dropped from a session's verbatim history into its rolling summary, on the planner model.
+    Returns the current summary unchanged on failure."""
+    try:
+        response = await get_planner_llm().acomplete(HISTORY_SUMMARY_PROMPT.format(
+            summary=summary or "None yet.",
+            exchange=_format_history(messages)
+        ))
+        return str(response).strip()
+    except Exception as e:
+        logger.error("Error updating history summary: %s", e)
+        return summary
+
+def _format_history(chat_history: List[Dict], history_str: Optional[str] = None) -> str:
+    """Render the chat history for a synthesis prompt, unless the caller already has it rendered."""
+    if history_str:
+        return history_str
+    if not chat_history:
+        return "No history yet."
+    return "\n".join(f"{msg['role']}: {msg['content']}" for msg in chat_history)
+
+def _co_reviewer_prompt(query: str, responses: List[Dict], chat_history: List[Dict], is_initial_review: bool, history_str: Optional[str]) -> Tuple[str, Dict]:
+    """Select the co-reviewer prompt template and the values to format it with."""
+    
+    # The initial review template has no chat history slot
+    history_str = "" if is_initial_review else _format_history(chat_history, history_str)
     
     # Format the responses for the prompt before defining the system prompt
     formatted_responses = "\n\n".join([
@@ -263,17 +749,23 @@ def synthesize_co_reviewer_response(query: str, responses: List[Dict], chat_hist
     # Extract key information from responses
     pr_info = {}
     file_changes = []
+    # PR metadata previews already tried; the same one often comes back from several collections
+    seen_previews = set()
     
     for resp in responses:
         if resp and resp.get("sources"):
             for source in resp["sources"]:
                 if "file_name" in source and source["file_name"].startswith("pr_"):
-                    # This is PR metadata
+                    # This is PR metadata. Truncated previews end in "..." and can never parse.
+                    text_preview = source["text_preview"]
+                    if text_preview in seen_previews or text_preview.endswith("..."):
+                        continue
+                    seen_previews.add(text_preview)
                     try:
-                        pr_data = json.loads(source["text_preview"])
+                        pr_data = orjson.loads(text_preview)
                         if isinstance(pr_data, dict):
                             pr_info.update(pr_data)
-                    except:
+                    except orjson.JSONDecodeError:
                         pass
                 elif "file_path" in source:
                     # This is a file change
@@ -284,157 +776,176 @@ def synthesize_co_reviewer_response(query: str, responses: List[Dict], chat_hist
     # --- Select Prompt Based on Initial vs Follow-up ---
     if is_initial_review:
         # Prompt for Initial Co-Reviewer Summary
-        system_prompt = """You are a Code Review Assistant generating an initial review summary.
-Your task is to create a structured code review summary based on the provided context.
-
-Available Information (Extracted from PR data, code, requirements):
-{formatted_responses}
-
-Additional Context:
-PR Metadata: {pr_metadata}
-File Changes: {file_changes}
-
-Instructions:
-1.  **Extract key details** (like PR number, title, author, status) from the PR Metadata section.
-2.  Generate a structured multi-aspect code review summary using this Markdown format:
-    ```markdown
-    ## Initial Code Review Summary: PR {{pr_number}} - {{pr_title}}
-
-    **Author:** {{extracted_author}}
-    **Status:** {{extracted_status}}
-
-    **1. Overview:**
-    [Briefly summarize the PR's purpose based on the description found in the available information.]
-
-    **2. Key Changes:**
-    [Summarize the main file changes and the nature of diffs based on the File Changes section. Mention key added/modified files.]
-
-    **3. Potential Areas for Focus:**
-    [Based on the provided info, suggest 1-2 general areas the user might want to look closer at, e.g., specific complex files, security aspects if mentioned, or major logic changes.]
-
-    **4. Next Steps:**
-    Please ask follow-up questions about specific files, logic, or concerns.
-    ```
-3.  **If certain information is missing, state that clearly instead of refusing.** Example: "I have retrieved some initial information, but crucial details like [missing detail] were not found in the available context. Here's what I could gather: [Provide partial summary]." Fill the template fields with "[Data not available]" if specific data points are missing.
-
-Initial Review Summary:"""
+        system_prompt = CO_REVIEWER_INITIAL_PROMPT
 
     else: # Co-reviewer follow-up
-        system_prompt = """You are a Code Review Assistant in 'co_reviewer' mode, responding to a follow-up query.
-Your task is to provide a concise, helpful answer based on the chat history and newly retrieved information.
-
-Chat History:
-{history_str}
-
-Available New Information (Extracted for the latest query):
-{formatted_responses}
-
-Additional Context:
-PR Metadata: {pr_metadata}
-File Changes: {file_changes}
-
-User Query: {query}
-
-Instructions:
-1.  Analyze the User Query in the context of the Chat History.
-2.  Use the Available New Information and Additional Context sections to answer the query.
-3.  If the query is about a specific file, check the File Changes section first.
-4.  Provide a clear, conversational response directly addressing the query.
-
-Assistant Response:"""
-
-    llm = OpenAI(model="gpt-4")
-    
-    # Format the selected prompt correctly using the variables
-    try:
-        final_response = llm.complete(
-            system_prompt.format(
-                mode=mode,
-                history_str=history_str if chat_history else "No history yet.",
-                formatted_responses=formatted_responses if responses else "No new information gathered.",
-                query=query,
-                pr_metadata=json.dumps(pr_info, indent=2),
-                file_changes=json.dumps(file_changes, indent=2)
-            )
-        )
-    except KeyError as e:
-        print(f"Error formatting co_reviewer prompt: Missing key {e}")
-        print(f"Selected prompt template:\n{system_prompt}")
-        final_response = "Sorry, there was an internal error formatting the response."
-    except Exception as e:
-        print(f"Error during LLM completion (co_reviewer): {e}")
-        final_response = "Sorry, there was an error generating the response."
-    
-    all_sources = []
-    collections_used = []
-    for resp in responses:
-        if resp:
-            all_sources.extend(resp.get("sources", []))
-            collections_used.append(resp.get("collection"))
-
-    return {
-        "answer": str(final_response),
-        "sources": all_sources,
-        "collections_used": list(set(filter(None, collections_used)))
-    }
+        system_prompt = CO_REVIEWER_FOLLOWUP_PROMPT
+
+    return system_prompt, dict(
+        history_str=history_str,
+        formatted_responses=formatted_responses if responses else "No new information gathered.",
+        query=query,
+        pr_metadata=orjson.dumps(pr_info, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode(),
+        file_changes=orjson.dumps(file_changes, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+    )
 
-# RAG Synthesis Function for Interactive Assistant Mode
-def synthesize_interactive_response(query: str, responses: List[Dict], chat_history: List[Dict], mode: str) -> Dict:
-    """Synthesize responses for interactive assistant mode."""
+def _interactive_prompt(query: str, responses: List[Dict], chat_history: List[Dict], history_str: Optional[str]) -> Tuple[str, Dict]:
+    """Return the interactive prompt template and the values to format it with."""
     
-    history_str = "\n".join([f"{msg['role']}: {msg['content']}" for msg in chat_history])
+    history_str = _format_history(chat_history, history_str)
     
     formatted_responses = "\n\n".join([
         f"From {resp['collection']}:\n{resp['answer']}"
         for resp in responses if resp
     ])
     
-    system_prompt = """You are an Interactive Code Assistant.
-Your task is to provide helpful answers to the user's query based on the chat history and newly retrieved information.
-
-Chat History:
-{history_str}
-
-Available New Information (Extracted for the latest query):
-{formatted_responses}
-
-User Query: {query}
-
-Instructions:
-1.  Analyze the User Query in the context of the Chat History.
-2.  Use the Available New Information section and the history to formulate your answer.
-3.  Provide a clear, conversational, and helpful response.
+    system_prompt = INTERACTIVE_PROMPT
 
-Assistant Response:"""
+    return system_prompt, dict(
+        history_str=history_str,
+        formatted_responses=formatted_responses if responses else "No new information gathered.",
+        query=query
+    )
 
-    llm = OpenAI(model="gpt-4")
-    
+async def _acomplete_synthesis(system_prompt: str, prompt_values: Dict, label: str) -> str:
+    """Format the synthesis prompt and complete it, returning an apology message on failure."""
     try:
-        final_response = llm.complete(
-            system_prompt.format(
-                mode=mode, # Should be interactive_assistant
-                history_str=history_str if chat_history else "No history yet.",
-                formatted_responses=formatted_responses if responses else "No new information gathered.",
-                query=query
-            )
-        )
+        return str(await get_llm().acomplete(system_prompt.format_map(prompt_values)))
     except KeyError as e:
-        print(f"Error formatting interactive prompt: Missing key {e}")
-        print(f"Selected prompt template:\n{system_prompt}")
-        final_response = "Sorry, there was an internal error formatting the response."
+        logger.error("Error formatting %s prompt: Missing key %s", label, e)
+        logger.debug("Selected prompt template:\n%s", system_prompt)
+        return "Sorry, there was an internal error formatting the response."
     except Exception as e:
-        print(f"Error during LLM completion (interactive): {e}")
-        final_response = "Sorry, there was an error generating the response."
+        logger.error("Error during LLM completion (%s): %s", label, e)
+        return "Sorry, there was an error generating the response."
+
+def source_key(source: Dict) -> Tuple[str, str]:
+    """Identity of a source entry, for dropping the copies of a node retrieved more than once."""
+    return (source.get("file_path") or source.get("file_name") or "", source.get("text_preview", ""))
 
-    all_sources = []
+def _synthesis_result(final_response: str, responses: List[Dict]) -> Dict:
+    """Attach the sources and collections of the responses to the synthesized answer."""
+    # The same node can come back from several collections, so keep the first copy of each
+    all_sources: Dict[Tuple[str, str], Dict] = {}
     collections_used = []
     for resp in responses:
-        if resp:
-            all_sources.extend(resp.get("sources", []))
-            collections_used.append(resp.get("collection"))
+        if not resp:
+            continue
+        for source in resp.get("sources", []):
+            all_sources.setdefault(source_key(source), source)
+        collections_used.append(resp.get("collection"))
 
     return {
-        "answer": str(final_response),
-        "sources": all_sources,
-        "collections_used": list(set(filter(None, collections_used)))
-    } 
\ No newline at end of file
+        "answer": final_response,
+        "sources": list(all_sources.values()),
+        "collections_used": list(dict.fromkeys(filter(None, collections_used)))
+    }
+
+async def _aquery_embedding(embed_model: BaseEmbedding, embed_key: Tuple, query: str, query_digest: str) -> List[float]:
+    """The query's embedding from _QUERY_EMBEDDING_CACHE, embedding it on a miss."""
+    key = (embed_key, query_digest)
+    embedding = _QUERY_EMBEDDING_CACHE.get(key)
+    if embedding is not None:
+        _QUERY_EMBEDDING_CACHE.move_to_end(key)
+        return embedding
+    embedding = await embed_model.aget_query_embedding(query)
+    _QUERY_EMBEDDING_CACHE[key] = embedding
+    if len(_QUERY_EMBEDDING_CACHE) > QUERY_EMBEDDING_CACHE_MAX_ENTRIES:
+        _QUERY_EMBEDDING_CACHE.popitem(last=False)
+    return embedding
+
+async def multi_collection_retrieve(session_query_engines: Dict, collection_names: List[str], query: str, focus: str) -> List[Dict]:
+    """Retrieve from several collections without a per-collection LLM answer.
+    The query is embedded once per embedding model, nodes are re-ranked by score across collections,
+    duplicate chunks are dropped, and the top MULTI_COLLECTION_TOP_K (more for broad queries) that fit
+    RETRIEVAL_TOKEN_BUDGET are returned as {answer, sources, collection} responses whose
+    answer is the retrieved text, leaving a single synthesis call to the caller."""
+    focused_query = f"""{query}
+
+Focus on: {focus}"""
+    # One embedding task per distinct embedding model, shared by the collections that use it
+    embedding_tasks = {}
+    top_k_factor = _retrieval_top_k_factor(query)
+    similarity_top_k = SIMILARITY_TOP_K * top_k_factor
+    # Hot queries skip both the query embedding and the vector search
+    cache_key = (hashlib.blake2b(focused_query.encode(), digest_size=16).hexdigest(), similarity_top_k)
+
+    async def retrieve(collection_name: str) -> List[Tuple[float, str, object]]:
+        if collection_name not in session_query_engines:
+            logger.error("Collection '%s' not found in session query engines", collection_name)
+            return []
+        try:
+            collection_handle = session_query_engines[collection_name]
+            await collection_handle.aload()
+            nodes = collection_handle.cached_nodes(cache_key)
+            if nodes is None:
+                retriever = collection_handle.retriever_for(similarity_top_k)
+
+                async def search() -> List:
+                    embed_model = retriever._embed_model
+                    embed_key = (type(embed_model).__name__, embed_model.model_name, getattr(embed_model, "dimensions", None))
+                    if embed_key not in embedding_tasks:
+                        embedding_tasks[embed_key] = asyncio.ensure_future(
+                            _aquery_embedding(embed_model, embed_key, focused_query, cache_key[0])
+                        )
+                    # Shielded: a timed-out collection must not cancel the embedding other collections share
+                    embedding = await asyncio.shield(embedding_tasks[embed_key])
+                    return await retriever.aretrieve(QueryBundle(query_str=focused_query, embedding=embedding))
+
+                nodes = await collection_handle.aretrieve_once(cache_key, search)
+            return [(node.score or 0.0, collection_name, node) for node in nodes]
+        except Exception as e:
+            logger.error("Error retrieving from collection '%s': %s", collection_name, e)
+            return []
+
+    async def retrieve_in_time(collection_name: str) -> List[Tuple[float, str, object]]:
+        try:
+            return await asyncio.wait_for(retrieve(collection_name), COLLECTION_RETRIEVAL_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            logger.warning("Retrieval from collection '%s' timed out after %ss, skipping it", collection_name, COLLECTION_RETRIEVAL_TIMEOUT_SECONDS)
+            return []
+
+    retrieved = await asyncio.gather(*(retrieve_in_time(name) for name in collection_names))
+    ranked = sorted((hit for hits in retrieved for hit in hits), key=lambda hit: hit[0], reverse=True)
+
+    # The same chunk can be indexed in several collections; keep its best-scoring copy only.
+    # Stop at the top_k or token budget, whichever comes first; the best node is always kept.
+    nodes_by_collection: Dict[str, List] = {}
+    seen_contents = set()
+    tokenize = get_tokenizer()
+    token_budget = RETRIEVAL_TOKEN_BUDGET * top_k_factor
+    for _, collection_name, node in ranked:
+        content = node.get_content()
+        content_digest = hashlib.blake2b(content.encode(), digest_size=16).digest()
+        if content_digest in seen_contents:
+            continue
+        token_budget -= len(tokenize(content))
+        if token_budget < 0 and seen_contents:
+            break
+        seen_contents.add(content_digest)
+        nodes_by_collection.setdefault(collection_name, []).append(node)
+        if len(seen_contents) == MULTI_COLLECTION_TOP_K * top_k_factor:
+            break
+
+    return [
+        {
+            "answer": "\n\n".join(node.get_content() for node in nodes_by_collection[name]),
+            "sources": [_source_info(node) for node in nodes_by_collection[name]],
+            "collection": name
+        }
+        for name in collection_names if name in nodes_by_collection
+    ]
+
+# RAG Synthesis Function for Co-Reviewer Mode
+async def asynthesize_co_reviewer_response(query: str, responses: List[Dict], chat_history: List[Dict], mode: str, is_initial_review: bool, history_str: Optional[str] = None) -> Dict:
+    """Synthesize responses for co-reviewer mode (initial or follow-up)."""
+    system_prompt, prompt_values = _co_reviewer_prompt(query, responses, chat_history, is_initial_review, history_str)
+    final_response = await _acomplete_synthesis(system_prompt, prompt_values, "co_reviewer")
+    return _synthesis_result(final_response, responses)
+
+# RAG Synthesis Function for Interactive Assistant Mode
+async def asynthesize_interactive_response(query: str, responses: List[Dict], chat_history: List[Dict], mode: str, history_str: Optional[str] = None) -> Dict:
+    """Synthesize responses for interactive assistant mode."""
+    system_prompt, prompt_values = _interactive_prompt(query, responses, chat_history, history_str)
+    final_response = await _acomplete_synthesis(system_prompt, prompt_values, "interactive")
+    return _synthesis_result(final_response, responses)
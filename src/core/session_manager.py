@@ -1,21 +1,68 @@
-from typing import Dict, Optional
-import uuid
+from typing import Dict, List, Optional
+from collections import OrderedDict, deque
+import logging
+import secrets
 
+from fastapi import HTTPException
 from src.schemas.chat import SessionData
 from src.core import rag_utils
+from src.core.session_store import SQLiteSessionStore
+
+# Messages kept verbatim per session: the 4 (user, assistant) turns the synthesis tools send to the LLM.
+# Older turns are folded into the session's rolling history summary.
+MAX_HISTORY_MESSAGES = 8
+# Sessions whose query engines this process keeps, least recently used evicted first
+MAX_LOCAL_SESSIONS = 10_000
+
+logger = logging.getLogger(__name__)
+
+def _render_message(message: Dict) -> str:
+    return f"{message['role']}: {message['content']}"
 
 class SessionManager:
-    def __init__(self):
-        # In-memory storage for sessions
-        self._sessions: Dict[str, SessionData] = {}
+    def __init__(self, store: Optional[SQLiteSessionStore] = None):
+        # Session metadata and chat history, shared by all worker processes
+        self._store = store or SQLiteSessionStore()
+        # This process's SessionData by ID, holding its query engines. Evicted sessions
+        # are rebuilt from the store on their next request.
+        self._sessions: OrderedDict[str, SessionData] = OrderedDict()
+    
+    def _keep(self, session_id: str, session: SessionData):
+        self._sessions[session_id] = session
+        self._sessions.move_to_end(session_id)
+        if len(self._sessions) > MAX_LOCAL_SESSIONS:
+            self._sessions.popitem(last=False)
     
     def get_session(self, session_id: str) -> Optional[SessionData]:
         """Retrieve a session by ID."""
-        return self._sessions.get(session_id)
+        stored = self._store.get(session_id)
+        if stored is None:
+            self._sessions.pop(session_id, None)
+            return None
+        
+        session = self._sessions.get(session_id)
+        if session is None or session.pr_id != stored["pr_id"]:
+            # Created by another worker or before a restart: attach this process's query engines
+            index_data = rag_utils.load_project_index(stored["pr_id"])
+            session = SessionData(
+                pr_id=stored["pr_id"],
+                mode=stored["mode"],
+                query_engines=index_data["query_engines"],
+                collections=index_data["collections"]
+            )
+        self._keep(session_id, session)
+        
+        # Another worker may have advanced the conversation. History is a bounded deque (see create_session).
+        session.mode = stored["mode"]
+        session.chat_history = deque(stored["chat_history"], maxlen=MAX_HISTORY_MESSAGES)
+        session.rendered_history = deque(map(_render_message, stored["chat_history"]), maxlen=MAX_HISTORY_MESSAGES)
+        session.initial_review_generated = stored["initial_review_generated"]
+        session.history_summary = stored["history_summary"]
+        return session
     
     def create_session_id(self) -> str:
-        """Generate a new unique session ID."""
-        return str(uuid.uuid4())
+        """Generate a new unique session ID: 128 random bits, URL-safe, shorter than a formatted UUID."""
+        return secrets.token_urlsafe(16)
     
     def create_session(self, session_id: str, pr_id: str, mode: str = "co_reviewer") -> SessionData:
         """Create a new session with the given parameters."""
@@ -33,41 +80,60 @@ class SessionManager:
                 collections=index_data["collections"]
             )
             
+            # Bounded, so appending a turn drops the oldest messages without copying the list
+            session_data.chat_history = deque(maxlen=MAX_HISTORY_MESSAGES)
+            session_data.rendered_history = deque(maxlen=MAX_HISTORY_MESSAGES)
+            
             # Store the session
-            self._sessions[session_id] = session_data
+            self._store.create(session_id, pr_id, mode)
+            self._keep(session_id, session_data)
             
             return session_data
             
+        except HTTPException:
+            # Already logged where it was raised, and the status code is meant for the client
+            raise
         except Exception as e:
-            print(f"Error creating session: {e}")
+            logger.error("Error creating session: %s", e)
             raise e
     
     def store_session(self, session_id: str, session_data: SessionData):
-        """Store a session in memory."""
-        self._sessions[session_id] = session_data
+        """Keep a session's in-process data (its query engines) for this worker."""
+        self._keep(session_id, session_data)
+    
+    def drop_project_sessions(self, pr_id: str):
+        """Forget this process's SessionData for the PR's sessions. They are rebuilt from the store on their next
+        request, with the PR's current collection handles."""
+        for session_id in [session_id for session_id, session in self._sessions.items() if session.pr_id == pr_id]:
+            self._sessions.pop(session_id, None)
     
-    def update_session_history(self, session_id: str, user_query: str, ai_answer: str):
-        """Update the chat history for a session."""
-        session = self.get_session(session_id)
+    def update_session_history(self, session_id: str, user_query: str, ai_answer: str) -> List[Dict]:
+        """Update the chat history for a session. Returns the messages that fell out of the verbatim history."""
+        messages = [
+            {"role": "user", "content": user_query},
+            {"role": "assistant", "content": ai_answer}
+        ]
+        # The store's trimmed rows are authoritative: this worker may not hold the session, or hold a stale copy
+        dropped = self._store.append_history(session_id, messages, MAX_HISTORY_MESSAGES)
+        
+        session = self._sessions.get(session_id)
+        if not session:
+            return dropped
+        session.chat_history.extend(messages)
+        # Render each message once here rather than on every synthesis call
+        session.rendered_history.extend(map(_render_message, messages))
+        return dropped
+    
+    def set_history_summary(self, session_id: str, history_summary: str):
+        """Store the rolling summary of a session's older turns."""
+        self._store.set_history_summary(session_id, history_summary)
+        session = self._sessions.get(session_id)
         if session:
-            # Add user message
-            session.chat_history.append({
-                "role": "user",
-                "content": user_query
-            })
-            
-            # Add AI message
-            session.chat_history.append({
-                "role": "assistant",
-                "content": ai_answer
-            })
-            
-            # Store updated session
-            self.store_session(session_id, session)
+            session.history_summary = history_summary
             
     def set_initial_review_generated(self, session_id: str):
         """Mark that the initial review has been generated for a session."""
-        session = self.get_session(session_id)
+        self._store.set_initial_review_generated(session_id)
+        session = self._sessions.get(session_id)
         if session:
             session.initial_review_generated = True
-            self.store_session(session_id, session) 
\ No newline at end of file
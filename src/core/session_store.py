@@ -0,0 +1,157 @@
+from typing import Dict, List, Optional
+from contextlib import contextmanager
+import os
+import sqlite3
+import time
+
+# Default location of the shared session database, at the project root
+DEFAULT_SESSION_DB_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), ".sessions.sqlite3"
+)
+# Sessions idle for longer than this are treated as gone and deleted
+SESSION_TTL_SECONDS = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    pr_id TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    initial_review_generated INTEGER NOT NULL DEFAULT 0,
+    last_used REAL NOT NULL DEFAULT 0,
+    history_summary TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS messages (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, seq);
+CREATE INDEX IF NOT EXISTS sessions_last_used ON sessions (last_used);
+CREATE TABLE IF NOT EXISTS initial_reviews (
+    pr_id TEXT PRIMARY KEY,
+    index_signature REAL NOT NULL,
+    response TEXT NOT NULL
+);
+"""
+
+class SQLiteSessionStore:
+    """Session metadata and chat history in SQLite, shared by every worker process on the host, along with
+    each PR's initial review. Only plain data is stored here; query engines stay in each process's project index cache."""
+
+    def __init__(self, path: Optional[str] = None, ttl_seconds: float = SESSION_TTL_SECONDS):
+        self.path = path or os.getenv("SESSION_DB_PATH", DEFAULT_SESSION_DB_PATH)
+        self.ttl_seconds = ttl_seconds
+        with self._connect() as conn:
+            # WAL lets readers in other workers proceed while one worker writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Add the columns missing from databases created by earlier versions
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(sessions)")]
+            if columns and "last_used" not in columns:
+                conn.execute("ALTER TABLE sessions ADD COLUMN last_used REAL NOT NULL DEFAULT 0")
+            if columns and "history_summary" not in columns:
+                conn.execute("ALTER TABLE sessions ADD COLUMN history_summary TEXT NOT NULL DEFAULT ''")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # A short-lived connection per operation is safe across threads and processes
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        """Return the session's metadata and chat history, or None if it doesn't exist or has expired."""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT pr_id, mode, initial_review_generated, history_summary FROM sessions WHERE session_id = ? AND last_used >= ?",
+                (session_id, now - self.ttl_seconds)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE sessions SET last_used = ? WHERE session_id = ?", (now, session_id))
+            messages = conn.execute(
+                "SELECT role, content FROM messages WHERE session_id = ? ORDER BY seq",
+                (session_id,)
+            ).fetchall()
+        return {
+            "pr_id": row[0],
+            "mode": row[1],
+            "initial_review_generated": bool(row[2]),
+            "history_summary": row[3],
+            "chat_history": [{"role": role, "content": content} for role, content in messages]
+        }
+
+    def create(self, session_id: str, pr_id: str, mode: str):
+        """Store a new session with an empty chat history, deleting the sessions that have expired."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM messages WHERE session_id IN (SELECT session_id FROM sessions WHERE last_used < ?)",
+                (now - self.ttl_seconds,)
+            )
+            conn.execute("DELETE FROM sessions WHERE last_used < ?", (now - self.ttl_seconds,))
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, pr_id, mode, last_used) VALUES (?, ?, ?, ?)",
+                (session_id, pr_id, mode, now)
+            )
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+
+    def append_history(self, session_id: str, messages: List[Dict], max_messages: int) -> List[Dict]:
+        """Append messages to the session's chat history, keeping only the latest max_messages.
+        Returns the trimmed messages, oldest first."""
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)",
+                [(session_id, message["role"], message["content"]) for message in messages]
+            )
+            # The insert holds the write lock, so no other worker changes the history between these statements
+            trimmed = conn.execute(
+                """SELECT seq, role, content FROM messages WHERE session_id = ? AND seq NOT IN (
+                    SELECT seq FROM messages WHERE session_id = ? ORDER BY seq DESC LIMIT ?
+                ) ORDER BY seq""",
+                (session_id, session_id, max_messages)
+            ).fetchall()
+            if trimmed:
+                conn.execute(
+                    "DELETE FROM messages WHERE session_id = ? AND seq <= ?",
+                    (session_id, trimmed[-1][0])
+                )
+        return [{"role": role, "content": content} for _, role, content in trimmed]
+
+    def set_initial_review_generated(self, session_id: str):
+        """Mark that the initial review has been generated for a session."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE sessions SET initial_review_generated = 1 WHERE session_id = ?",
+                (session_id,)
+            )
+
+    def set_history_summary(self, session_id: str, history_summary: str):
+        """Store the rolling summary of the session's older turns."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE sessions SET history_summary = ? WHERE session_id = ?",
+                (history_summary, session_id)
+            )
+
+    def get_initial_review(self, pr_id: str, index_signature: float) -> Optional[str]:
+        """Return the PR's stored initial review response (JSON), if generated from the same index."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT response FROM initial_reviews WHERE pr_id = ? AND index_signature = ?",
+                (pr_id, index_signature)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_initial_review(self, pr_id: str, index_signature: float, response: str):
+        """Store the PR's initial review response (JSON), replacing one from an older index."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO initial_reviews (pr_id, index_signature, response) VALUES (?, ?, ?)",
+                (pr_id, index_signature, response)
+            )
@@ -1,28 +1,69 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import logging
+import logging.handlers
+import os
+import queue
 import uvicorn
 
 from src.routers import chat
+from src.agent.llm import close_shared_client
 
 # Load environment variables (like OPENAI_API_KEY)
 load_dotenv()
 
+# Fail at startup rather than on the first chat request
+if os.getenv("OPENAI_API_KEY", "") in ("", "your_openai_api_key_here"):
+    raise RuntimeError("OPENAI_API_KEY is missing or set to the .env.example placeholder.")
+
+# DEBUG also traces planning prompts, plans and per-collection queries.
+# Request handlers only enqueue records; a listener thread formats and writes them to stderr.
+log_queue = queue.SimpleQueue()
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), handlers=[logging.handlers.QueueHandler(log_queue)])
+log_listener.start()
+
 # Create FastAPI app
-app = FastAPI(title="Code Review Agent API", description="API for Code Review AI Assistant")
-
-# Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Allows all origins
-    allow_credentials=True,
-    allow_methods=["*"],  # Allows all methods
-    allow_headers=["*"],  # Allows all headers
+# ORJSONResponse serializes the sources-heavy chat responses several times faster than the stdlib encoder
+app = FastAPI(
+    title="Code Review Agent API",
+    description="API for Code Review AI Assistant",
+    default_response_class=ORJSONResponse
 )
 
+# Add CORS middleware only when a browser frontend on another origin needs it
+frontend_origins = [origin.strip() for origin in os.getenv("FRONTEND_ORIGIN", "").split(",") if origin.strip()]
+if frontend_origins:
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=frontend_origins,
+        allow_methods=["GET", "POST"],
+        allow_headers=["Content-Type", "Authorization"],
+    )
+
 # Include the router with no prefix to match original API
 app.include_router(chat.router)
 
+# Bounded pool behind asyncio.to_thread (session preparation, index loads from disk)
+executor = ThreadPoolExecutor(max_workers=min(32, 4 * (os.cpu_count() or 1)), thread_name_prefix="blocking")
+
+@app.on_event("startup")
+async def startup():
+    asyncio.get_running_loop().set_default_executor(executor)
+
+@app.on_event("shutdown")
+async def shutdown():
+    await close_shared_client()
+    executor.shutdown(wait=False)
+    # Flushes the records still queued
+    log_listener.stop()
+
 # Health check endpoint (optional, but good practice)
 @app.get("/")
 def read_root():
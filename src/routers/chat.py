@@ -1,10 +1,27 @@
-from fastapi import APIRouter, HTTPException
+import logging
+import os
+import secrets
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import StreamingResponse
+import orjson
 from src.services.agent_service import AgentService
+from src.core import rag_utils
 from src.schemas.chat import ChatRequest, ChatResponse
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 agent_service = AgentService()
 
+def require_admin(authorization: str = Header(default="")):
+    """Allow maintenance endpoints only with "Authorization: Bearer $ADMIN_TOKEN"; they are off without ADMIN_TOKEN."""
+    admin_token = os.getenv("ADMIN_TOKEN", "")
+    if not admin_token:
+        raise HTTPException(status_code=403, detail="Maintenance endpoints are disabled (ADMIN_TOKEN is not set)")
+    if not secrets.compare_digest(authorization.encode(), f"Bearer {admin_token}".encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
 @router.post("/chat", response_model=ChatResponse)
 async def handle_chat(request: ChatRequest):
     """
@@ -17,7 +34,8 @@ async def handle_chat(request: ChatRequest):
             request=request.query,
             session_id=request.session_id,
             pr_id=request.pr_id,
-            mode=request.mode
+            mode=request.mode,
+            synthesize=request.synthesize
         )
         
         # Map AgentResponse to ChatResponse format
@@ -43,8 +61,58 @@ async def handle_chat(request: ChatRequest):
     except HTTPException as e:
         raise e
     except Exception as e:
-        print(f"Error in handle_chat: {e}")
+        logger.error("Error in handle_chat: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"An unexpected error occurred: {str(e)}"
-        ) 
\ No newline at end of file
+        ) 
+
+@router.post("/chat/stream")
+async def handle_chat_stream(request: ChatRequest):
+    """
+    Streaming variant of /chat using Server-Sent Events.
+    Emits a `sources` event as soon as the sources are known (when the answer
+    is synthesized from tool results), `token` events with answer text as it is
+    generated, then a single `response` event carrying the complete ChatResponse.
+    """
+    token_stream = await agent_service.stream_request(
+        request=request.query,
+        session_id=request.session_id,
+        pr_id=request.pr_id,
+        mode=request.mode
+    )
+    
+    async def event_stream():
+        try:
+            async for item in token_stream:
+                if isinstance(item, ChatResponse):
+                    yield f"event: response\ndata: {item.model_dump_json()}\n\n"
+                elif isinstance(item, dict):
+                    yield f"event: sources\ndata: {orjson.dumps(item).decode()}\n\n"
+                else:
+                    yield f"event: token\ndata: {orjson.dumps(item).decode()}\n\n"
+        except Exception as e:
+            # Headers are already sent, so errors are reported in-band
+            logger.error("Error in handle_chat_stream: %s", e)
+            yield f"event: error\ndata: {orjson.dumps({'detail': f'An unexpected error occurred: {str(e)}'}).decode()}\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@router.post("/projects/{pr_id}/invalidate", dependencies=[Depends(require_admin)])
+async def invalidate_project(pr_id: str):
+    """
+    Drop everything the worker handling this request caches for a PR (index, plans,
+    cached responses and its sessions' collection handles), e.g. right after re-indexing it.
+    Only that worker process is affected; every worker picks up a re-index on its own once
+    the index files' modification times change.
+    """
+    agent_service.invalidate_project(pr_id)
+    return {"pr_id": pr_id, "invalidated": True}
+
+@router.get("/stats/plan-cache", dependencies=[Depends(require_admin)])
+async def plan_cache_stats():
+    """
+    Hit, miss and eviction counts of the collection plan caches, for tuning their sizes,
+    PLAN_SIMILARITY_THRESHOLD and KEYWORD_ROUTES. Counts are per worker process.
+    """
+    return rag_utils.plan_cache_stats()
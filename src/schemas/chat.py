@@ -1,14 +1,20 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, SkipValidation
 from typing import Dict, List, Optional, Literal, Any
 
 # === Session Data Model ===
 class SessionData(BaseModel):
     pr_id: str
     mode: Literal["co_reviewer", "interactive_assistant"]
-    chat_history: List[Dict] = []
+    chat_history: List[Dict] = Field(default_factory=list)
+    # chat_history rendered as "role: content" lines, kept in step by the session manager
+    rendered_history: List[str] = Field(default_factory=list)
+    # Rolling summary of the turns that have fallen out of chat_history
+    history_summary: str = ""
     initial_review_generated: bool = False
-    query_engines: Dict = {}
-    collections: List[str] = []
+    # Collection name -> CollectionHandle, shared with the project index cache. Neither validated
+    # (handles are opaque LlamaIndex/Chroma objects) nor serialized.
+    query_engines: SkipValidation[Dict] = Field(default_factory=dict, exclude=True)
+    collections: List[str] = Field(default_factory=list)
 
 # === API Request/Response Models ===
 class ChatRequest(BaseModel):
@@ -16,6 +22,8 @@ class ChatRequest(BaseModel):
     pr_id: str
     mode: Literal["co_reviewer", "interactive_assistant"]
     session_id: Optional[str] = None
+    # False returns the information the tools gathered, without the final LLM synthesis
+    synthesize: bool = True
 
 class ChatResponse(BaseModel):
     session_id: str
@@ -1,66 +1,147 @@
-from typing import Dict, Any
+from typing import Dict, Any, AsyncIterator, List, Set, Tuple, Union
+import asyncio
 from fastapi import HTTPException
-import traceback
+import logging
 from src.agent.base import BaseAgent
 from src.schemas.chat import ChatResponse
 from src.agent.tools import AVAILABLE_TOOLS
+from src.agent.cache import SemanticResponseCache
 from src.core.session_manager import SessionManager
-from llama_index.llms.openai import OpenAI
+from src.core.session_store import SQLiteSessionStore
+from src.core import rag_utils
+from src.agent.llm import shared_llm
+
+logger = logging.getLogger(__name__)
+
+# Sent in place of the user's first co_reviewer request. Constant, so every new session of a PR
+# shares its plan, retrieval and response cache entries.
+INITIAL_REVIEW_REQUEST = "Generate a comprehensive initial code review summary for this PR."
 
 class AgentService:
     def __init__(self):
-        self.llm = OpenAI(model="gpt-4")
-        self.agent = BaseAgent(self.llm)
-        self.session_manager = SessionManager()
+        self.llm = shared_llm
+        # One store for sessions and the PRs' initial reviews, shared by all worker processes
+        store = SQLiteSessionStore()
+        self.response_cache = SemanticResponseCache(
+            # Same model instance as the planner's semantic cache
+            embed_model=rag_utils.get_plan_embed_model(),
+            review_store=store
+        )
+        self.agent = BaseAgent(self.llm, response_cache=self.response_cache)
+        self.session_manager = SessionManager(store)
+        # Running history summary updates, referenced so they aren't garbage collected mid-flight
+        self._summary_tasks: Set[asyncio.Task] = set()
         
         # Register all available tools
         for tool in AVAILABLE_TOOLS:
             self.agent.register_tool(tool)
     
-    async def process_request(self, request: str, session_id: str, pr_id: str, mode: str = "co_reviewer") -> ChatResponse:
-        """Process a user request through the agent."""
-        try:
-            # Get or create session
-            session = None
-            if session_id:
-                session = self.session_manager.get_session(session_id)
-                
-            if not session:
-                # Create new session if needed
-                session_id = self.session_manager.create_session_id()
-                session = self.session_manager.create_session(session_id, pr_id, mode)
-                
-            # Handle initial review for co_reviewer mode
-            is_initial_request = not session.initial_review_generated and session.mode == "co_reviewer"
+    def _prepare_request(self, request: str, session_id: str, pr_id: str, mode: str) -> Tuple[str, Dict[str, Any]]:
+        """Get or create the session and build the agent's (request, session_data) for this turn.
+        Blocking (session store and index directory I/O), so callers run it in a worker thread."""
+        # Get or create session
+        session = None
+        if session_id:
+            session = self.session_manager.get_session(session_id)
+            
+        if not session:
+            # Create new session if needed
+            session_id = self.session_manager.create_session_id()
+            session = self.session_manager.create_session(session_id, pr_id, mode)
             
-            actual_request = request
-            if is_initial_request:
-                # For initial co_reviewer requests, use a standard prompt
-                actual_request = "Generate a comprehensive initial code review summary for this PR."
-                # Mark as generated
-                self.session_manager.set_initial_review_generated(session_id)
+        # Handle initial review for co_reviewer mode
+        is_initial_request = not session.initial_review_generated and session.mode == "co_reviewer"
+        
+        actual_request = request
+        if is_initial_request:
+            # For initial co_reviewer requests, use a standard prompt
+            actual_request = INITIAL_REVIEW_REQUEST
+            # Mark as generated
+            self.session_manager.set_initial_review_generated(session_id)
+        
+        session_data = {
+            "session_id": session_id,
+            "pr_id": pr_id,
+            "chat_history": session.chat_history,
+            "session": session,  # Pass the entire session object
+            "mode": mode,
+            "is_initial_request": is_initial_request
+        }
+        return actual_request, session_data
+    
+    def invalidate_project(self, pr_id: str):
+        """Drop everything this process caches for the PR: its index and plans, cached responses, and its sessions'
+        collection handles. Per process: other workers only notice a re-index through the index signature."""
+        rag_utils.invalidate_project_index(pr_id)
+        self.response_cache.invalidate(pr_id)
+        self.session_manager.drop_project_sessions(pr_id)
+    
+    async def _record_turn(self, session_data: Dict[str, Any], request: str, answer: str):
+        """Append the answered turn to the session's history. Turns pushed out of the verbatim history
+        are folded into its summary in the background, so the response isn't held up by another LLM call."""
+        session_id = session_data["session_id"]
+        try:
+            dropped = await asyncio.to_thread(self.session_manager.update_session_history, session_id, request, answer)
+        except Exception as e:
+            logger.error("Error recording chat history for session %s: %s", session_id, e)
+            return
+        if dropped:
+            task = asyncio.create_task(self._summarize_history(session_id, session_data["session"].history_summary, dropped))
+            self._summary_tasks.add(task)
+            task.add_done_callback(self._summary_tasks.discard)
+    
+    async def _summarize_history(self, session_id: str, summary: str, dropped: List[Dict]):
+        new_summary = await rag_utils.aupdate_history_summary(summary, dropped)
+        if new_summary != summary:
+            try:
+                await asyncio.to_thread(self.session_manager.set_history_summary, session_id, new_summary)
+            except Exception as e:
+                logger.error("Error storing history summary for session %s: %s", session_id, e)
+    
+    async def process_request(self, request: str, session_id: str, pr_id: str, mode: str = "co_reviewer", synthesize: bool = True) -> ChatResponse:
+        """Process a user request through the agent. With synthesize=False, the answer is the gathered information."""
+        try:
+            actual_request, session_data = await asyncio.to_thread(self._prepare_request, request, session_id, pr_id, mode)
+            session_data["synthesize"] = synthesize
             
             # Process request through agent
             response = await self.agent.process_request(
                 request=actual_request,
-                session_data={
-                    "session_id": session_id,
-                    "pr_id": pr_id,
-                    "chat_history": session.chat_history,
-                    "session": session,  # Pass the entire session object
-                    "mode": mode,
-                    "is_initial_request": is_initial_request
-                }
+                session_data=session_data
             )
+            # Unsynthesized answers are raw retrieval results, not conversation
+            if synthesize:
+                await self._record_turn(session_data, actual_request, response.answer)
             
             return response
             
         except HTTPException as e:
             raise e
         except Exception as e:
-            print(f"Error in process_request: {e}")
-            traceback.print_exc()
+            logger.exception("Error in process_request: %s", e)
             raise HTTPException(
                 status_code=500,
                 detail=f"An unexpected error occurred: {str(e)}"
-            ) 
\ No newline at end of file
+            )
+    
+    async def stream_request(self, request: str, session_id: str, pr_id: str, mode: str = "co_reviewer") -> AsyncIterator[Union[str, Dict, ChatResponse]]:
+        """Stream a user request through the agent: sources, answer text deltas, then the complete ChatResponse.
+        Session setup happens before this returns, so setup errors still surface as HTTP errors."""
+        try:
+            actual_request, session_data = await asyncio.to_thread(self._prepare_request, request, session_id, pr_id, mode)
+        except HTTPException as e:
+            raise e
+        except Exception as e:
+            logger.exception("Error in stream_request: %s", e)
+            raise HTTPException(
+                status_code=500,
+                detail=f"An unexpected error occurred: {str(e)}"
+            )
+        
+        async def stream_and_record():
+            async for item in self.agent.stream_request(request=actual_request, session_data=session_data):
+                if isinstance(item, ChatResponse):
+                    await self._record_turn(session_data, actual_request, item.answer)
+                yield item
+        
+        return stream_and_record()